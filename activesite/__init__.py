@@ -0,0 +1,24 @@
+#############################################################################
+# Protein-ligand active site interactions
+#
+# Library core of activesiteinteractions.py and activesitemaps2img.py:
+#
+#   from activesite import PerceptionOptions, split, perceive, extract
+#
+#   protein, ligand = split(complexmol)
+#   asite = perceive(protein, ligand, PerceptionOptions(hbond=3.0))
+#   for record in extract(asite, load_subsite_map("bace")):
+#       ...
+#
+# extract_table returns the same records as a compact InteractionTable,
+# for keeping the results of many complexes in memory.
+#
+# The depiction toolkits are only loaded when activesite.depiction draws.
+#############################################################################
+from .options import PerceptionOptions, PERCEPTION_PARAMS, add_perception_arguments
+from .perception import split, split_complex, get_split_options, perceive, perceive_pocket, read_receptor, PocketSelector
+from .extraction import LIST_TYPE_CONTACTS, extract, iter_protein_interactions
+from .subsites import SubsiteMap, load_subsite_map
+from .records import InteractionTable, extract_table, make_table, make_record_tables
+from .output import FIELDS, InteractionWriter, write_interactions
+from .store import StructureStore
@@ -0,0 +1,470 @@
+#############################################################################
+# Batch processing of many complexes, or of many ligands against one
+# receptor, on a pool of worker processes
+#############################################################################
+import collections
+import glob
+import os
+from concurrent import futures
+from openeye import oechem
+from .perception import SPLIT_SETUP, split, PocketSelector, perceive_pocket, get_prefilter, crop_pocket
+from .cache import extract_interactions, get_hints_key, get_interactions_key
+from .manifest import BatchManifest
+from .store import is_store, iter_store_inputs, iter_prepared_inputs, load_prepared, read_prepared_receptor
+from .output import write_interactions
+from .columnar import ColumnarWriter
+from .records import make_table
+from .profiling import get_profiler, start_profile, finish_profile, profile_stage, report_profiles
+
+def iter_batch_inputs(spec):
+    """
+    Yields (name, path, data) batch items. A directory or a glob pattern gives
+    one complex per file, read by the worker from path. A single file is
+    streamed and each molecule is shipped to the workers as OEB bytes in data.
+    A prepared-structure store gives its complexes, see iter_store_inputs.
+
+    :raises IOError: when the single file cannot be opened
+    """
+    if os.path.isdir(spec) and is_store(spec):
+        for item in iter_store_inputs(spec):
+            yield item
+        return
+    if os.path.isdir(spec):
+        paths = sorted(os.path.join(spec, f) for f in os.listdir(spec))
+        paths = [path for path in paths if os.path.isfile(path) and oechem.OEIsReadable(path)]
+    elif os.path.isfile(spec):
+        paths = None
+    else:
+        paths = sorted(glob.glob(spec))
+
+    seen = set()
+    if paths is not None:
+        for path in paths:
+            yield get_unique_name(get_input_stem(path), seen), path, None
+        return
+
+    ifs = oechem.oemolistream()
+    if not ifs.open(spec):
+        raise IOError("Unable to open %s for reading" % spec)
+    stem = get_input_stem(spec)
+    for n, mol in enumerate(ifs.GetOEGraphMols(), 1):
+        title = mol.GetTitle().strip().replace(os.sep, "_")
+        yield get_unique_name(title or "%s_%d" % (stem, n), seen), spec, oechem.OEWriteMolToBytes(".oeb", mol)
+
+
+def get_unique_name(name, seen):
+    """
+    Suffixes name with _2, _3... until it is not in seen, and adds it to seen.
+
+    :type seen: set
+    :rtype: str
+    """
+    key, n = name, 1
+    while key in seen:
+        n += 1
+        key = "%s_%d" % (name, n)
+    seen.add(key)
+    return key
+
+
+def get_input_stem(path):
+    name = os.path.basename(path)
+    if name.endswith(".gz"):
+        name = name[:-3]
+    return os.path.splitext(name)[0]
+
+
+def read_batch_item(complexmol, path, data, fmt=".oeb"):
+    """
+    Reads the molecule from data (bytes in the fmt format) when given, or
+    else from path.
+    """
+    if data is not None:
+        return oechem.OEReadMolFromBytes(complexmol, fmt, data)
+    ifs = oechem.oemolistream()
+    if not ifs.open(path):
+        return False
+    return oechem.OEReadMolecule(ifs, complexmol)
+
+
+def perceive_complex(path, data, args, setup=SPLIT_SETUP, fmt=".oeb"):
+    """
+    Reads and splits a complex, from data (bytes in the fmt format, OEB by
+    default) when given, and perceives its interactions. A complex found in
+    a prepared-structure store is neither read nor split, see load_prepared.
+
+    :param setup: split setup, see perception.SPLIT_SETUPS
+    :rtype: tuple (oechem.OEInteractionHintContainer or None, error message)
+    """
+    try:
+        parts = load_prepared(args, path, data, setup)
+    except IOError as err:
+        return None, str(err)
+    if parts is None:
+        complexmol = oechem.OEGraphMol()
+        with profile_stage("read"):
+            ok = read_batch_item(complexmol, path, data, fmt)
+        if not ok:
+            return None, "Unable to read molecule from %s" % path
+
+        parts = split(complexmol, setup)
+        if parts is None:
+            return None, "Cannot separate complex!"
+
+    protein, ligand = parts
+    pocket = protein
+    radius = get_prefilter(args)
+    if radius > 0:
+        pocket = crop_pocket(protein, ligand, radius)
+    try:
+        return perceive_pocket(protein, pocket, ligand, args), None
+    except ValueError as err:
+        return None, str(err)
+
+
+def get_complex_setup(args, setup=SPLIT_SETUP):
+    """
+    :rtype: str (tag of the split setup and pre-filter in the cache keys)
+    """
+    radius = get_prefilter(args)
+    if radius > 0:
+        return "%s prefilter=%g" % (setup, radius)
+    return setup
+
+
+def process_batch_item(item, args):
+    """
+    Runs read, split, perception and extraction for one batch item in a
+    worker and writes its results into args.outdir.
+
+    :rtype: BatchResult
+    """
+    name, path, data = item
+    start_profile(args, name)
+    try:
+        interactions, error = extract_batch_item(item, args)
+        return write_batch_results(name, interactions, error, args)
+    except Exception as err:
+        return BatchResult(name, None, get_error_message(err), None, finish_profile())
+
+
+def extract_batch_item(item, args):
+    """
+    :rtype: tuple (interactions or None, error message)
+    """
+    name, path, data = item
+    source = data if data is not None else path
+    return extract_interactions(args, get_complex_setup(args), [source], perceive_complex, path, data, args)
+
+
+def get_batch_item_key(item, args):
+    """
+    :rtype: str (key of the interactions of a complex, see get_interactions_key)
+    """
+    name, path, data = item
+    source = data if data is not None else path
+    return get_interactions_key(get_hints_key(args, get_complex_setup(args), [source]), args)
+
+
+# outcome of one batch item: number of interactions written or error
+# message, InteractionTable for the columnar output and profile record
+BatchResult = collections.namedtuple("BatchResult", ["name", "count", "error", "rows", "profile"])
+
+def write_batch_results(name, interactions, error, args):
+    if interactions is None:
+        return BatchResult(name, None, error, None, finish_profile())
+    rows = None
+    if args.columnar:
+        # sent back to the parent as integer columns rather than dict rows
+        interactions = rows = make_table(interactions)
+    count = write_interactions(interactions, *get_batch_output_names(name, args))
+    return BatchResult(name, count, None, rows, finish_profile())
+
+
+def get_error_message(err):
+    return "%s: %s" % (type(err).__name__, err)
+
+
+def get_batch_output_names(name, args):
+    """
+    :rtype: tuple (TSV path, JSONL path)
+    """
+    base = os.path.join(args.outdir, name)
+    suffix = ".gz" if args.gzip else ""
+    return base + ".tsv" + suffix, base + ".jsonl" + suffix
+
+
+def imap_bounded(pool, func, items, max_in_flight, *extra, ordered=False, on_error=None):
+    """
+    Maps func over items on an executor, keeping at most max_in_flight
+    submitted tasks so that items are consumed lazily. Results are yielded in
+    completion order, or in input order with ordered=True (finished results
+    then count against max_in_flight until they are yielded).
+
+    When a worker process dies, every item in flight is yielded as
+    on_error(item, error) if on_error is given, after which BrokenProcessPool
+    is raised without consuming further items, so that the caller can go on
+    with the remaining items on a new pool.
+    """
+    items = iter(items)
+    pending = collections.OrderedDict()
+    broken = None
+    while True:
+        if broken is None:
+            for item in items:
+                try:
+                    pending[pool.submit(func, item, *extra)] = item
+                except futures.process.BrokenProcessPool as err:
+                    if on_error is None:
+                        raise
+                    broken = err
+                    yield on_error(item, err)
+                    break
+                if len(pending) >= max_in_flight:
+                    break
+        if not pending:
+            if broken is not None:
+                raise broken
+            return
+
+        if ordered:
+            done = [next(iter(pending))]
+            futures.wait(done)
+        else:
+            done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+        for future in done:
+            item = pending.pop(future)
+            try:
+                result = future.result()
+            except futures.process.BrokenProcessPool as err:
+                if on_error is None:
+                    raise
+                broken = err
+                result = on_error(item, err)
+            yield result
+
+
+# exception raised by the initializer of the worker process, see init_worker
+_init_error = None
+
+def init_worker(initializer, initargs):
+    """
+    Runs initializer in a worker process, keeping its exception to be raised
+    by the tasks instead of letting the worker exit and break the pool.
+    """
+    global _init_error
+    try:
+        initializer(*initargs)
+    except Exception as err:
+        _init_error = err
+
+
+def call_worker(item, worker, args):
+    if _init_error is not None:
+        raise _init_error
+    return worker(item, args)
+
+
+def iter_pool_results(args, worker, items, initializer=None, initargs=(), failed=None, ordered=False):
+    """
+    Runs worker over items on a pool of args.jobs processes, starting a new
+    pool when a worker process dies. The items in flight at that time are run
+    again one at a time, each in a process of its own, so that only the item
+    that kills its worker is reported as failed. Results are yielded in
+    completion order, or in input order with ordered=True.
+
+    An exception of initializer in a worker is raised here, the callers
+    running initializer in the parent first to report it before any pool.
+
+    :param failed: function of (name, error message) returning the result of
+                   a failed item, a BatchResult by default
+    """
+    if initializer is not None:
+        initializer, initargs = init_worker, (initializer, initargs)
+
+    def on_error(item, err):
+        with futures.ProcessPoolExecutor(max_workers=1, initializer=initializer, initargs=initargs) as pool:
+            try:
+                return pool.submit(call_worker, item, worker, args).result()
+            except futures.process.BrokenProcessPool:
+                pass
+        if failed is not None:
+            return failed(item[0], "Worker process exited")
+        return BatchResult(item[0], None, "Worker process exited", None, None)
+
+    items = iter(items)
+    while True:
+        with futures.ProcessPoolExecutor(max_workers=args.jobs, initializer=initializer, initargs=initargs) as pool:
+            try:
+                for result in imap_bounded(pool, call_worker, items, 2 * args.jobs, worker, args,
+                                           ordered=ordered, on_error=on_error):
+                    yield result
+                return
+            except futures.process.BrokenProcessPool:
+                oechem.OEThrow.Warning("A worker process exited, restarting the worker pool")
+
+
+def run_batch(args, spec, worker, getkey, initializer=None, initargs=(), setup=None):
+    """
+    Runs worker over the batch items of spec, recording the outcome of each
+    item into the manifest of the run. With args.resume, the items recorded
+    as done with the same key (inputs, setup and parameters, see getkey) and
+    whose outputs still exist are skipped.
+
+    :param setup: split setup of the complexes of spec, looked up in the
+                  store of args, see iter_prepared_inputs
+    """
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+
+    manifest = BatchManifest(get_manifest_name(args), args.resume)
+    inputs = iter_batch_inputs(spec)
+    if setup is not None:
+        inputs = iter_prepared_inputs(args, inputs, setup)
+    inputs = manifest.Pending(inputs, lambda item: getkey(item, args),
+                              lambda name: get_batch_output_names(name, args))
+
+    columnar = None
+    if args.columnar:
+        columnar = ColumnarWriter(args.columnar, args.fingerprint)
+
+    # prepared in the parent first, so that a bad receptor is reported once
+    # instead of failing every worker
+    if initializer is not None:
+        initializer(*initargs)
+    if args.jobs <= 1:
+        results = (worker(item, args) for item in inputs)
+    else:
+        results = iter_pool_results(args, worker, inputs, initializer, initargs)
+    try:
+        return report_batch(results, columnar, args, manifest)
+    finally:
+        manifest.Close()
+
+
+def get_manifest_name(args):
+    return args.manifest or os.path.join(args.outdir, "manifest.jsonl")
+
+
+def report_batch(results, columnar=None, args=None, manifest=None):
+    nfailed = 0
+    profiles = []
+    for result in results:
+        if result.profile is not None:
+            profiles.append(result.profile)
+        if result.error is not None:
+            nfailed += 1
+            oechem.OEThrow.Warning("%s: %s" % (result.name, result.error))
+        else:
+            print("%s\t%d" % (result.name, result.count))
+            if columnar is not None:
+                columnar.Add(result.name, result.rows)
+        if manifest is not None:
+            outputs = get_batch_output_names(result.name, args) if result.error is None else []
+            manifest.Record(result.name, result.error, result.count, outputs)
+    if columnar is not None:
+        columnar.Close()
+    if manifest is not None and manifest.nskipped:
+        oechem.OEThrow.Info("%d item(s) already done in %s were skipped" % (manifest.nskipped, manifest.path))
+        if columnar is not None:
+            oechem.OEThrow.Warning("The columnar output only holds the items processed in this run")
+    if args is not None:
+        report_profiles(args, profiles)
+    return 1 if nfailed else 0
+
+
+#############################################################################
+# PROTEIN-ONCE, MANY-LIGANDS MODE
+#############################################################################
+
+# receptor of the worker process, see init_receptor
+_receptor = None
+
+def init_receptor(args):
+    """
+    Prepares the receptor once per process, as a pocket selector when
+    args.pocket is set or the pre-filter is enabled.
+    """
+    global _receptor
+    get_profiler(args)
+    radius = get_receptor_radius(args)
+    with profile_stage("receptor"):
+        protein = read_prepared_receptor(args)
+        _receptor = PocketSelector(protein, radius) if radius > 0 else protein
+
+
+def get_receptor(ligand):
+    """
+    :rtype: tuple (receptor, receptor or pocket cropped around the ligand
+            or None, see PocketSelector.Crop)
+    """
+    if isinstance(_receptor, PocketSelector):
+        with profile_stage("pocket"):
+            return _receptor.protein, _receptor.Crop(ligand)
+    return _receptor, _receptor
+
+
+def get_receptor_radius(args):
+    """
+    :rtype: float (args.pocket, or the pre-filter radius, 0 for the whole receptor)
+    """
+    if args.pocket > 0:
+        return args.pocket
+    return get_prefilter(args)
+
+
+def get_receptor_setup(args):
+    return "receptor pocket=%g" % get_receptor_radius(args)
+
+
+def perceive_ligand(path, data, args):
+    """
+    Perceives one ligand pose against the receptor prepared by init_receptor.
+
+    :rtype: tuple (oechem.OEInteractionHintContainer or None, error message)
+    """
+    ligand = oechem.OEGraphMol()
+    with profile_stage("read"):
+        ok = read_batch_item(ligand, path, data)
+    if not ok:
+        return None, "Unable to read ligand from %s" % path
+
+    protein, pocket = get_receptor(ligand)
+    try:
+        return perceive_pocket(protein, pocket, ligand, args), None
+    except ValueError as err:
+        return None, str(err)
+
+
+def process_ligand_item(item, args):
+    """
+    Perceives one ligand pose against the receptor prepared by init_receptor
+    and writes its results into args.outdir.
+
+    :rtype: BatchResult
+    """
+    name, path, data = item
+    start_profile(args, name)
+    try:
+        interactions, error = extract_ligand_item(item, args)
+        return write_batch_results(name, interactions, error, args)
+    except Exception as err:
+        return BatchResult(name, None, get_error_message(err), None, finish_profile())
+
+
+def extract_ligand_item(item, args):
+    """
+    :rtype: tuple (interactions or None, error message)
+    """
+    name, path, data = item
+    source = data if data is not None else path
+    return extract_interactions(args, get_receptor_setup(args), [args.pname, source], perceive_ligand, path, data, args)
+
+
+def get_ligand_item_key(item, args):
+    """
+    :rtype: str (key of the interactions of a ligand pose against args.pname)
+    """
+    name, path, data = item
+    source = data if data is not None else path
+    return get_interactions_key(get_hints_key(args, get_receptor_setup(args), [args.pname, source]), args)
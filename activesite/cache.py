@@ -0,0 +1,270 @@
+#############################################################################
+# Content-addressed cache of the perceived interactions
+#############################################################################
+import gzip
+import hashlib
+import json
+import os
+from openeye import oechem
+from .options import PERCEPTION_PARAMS
+from .extraction import LIST_TYPE_CONTACTS, iter_protein_interactions
+from .subsites import BUILTIN_SUBSITE_MAPS, get_subsite_map
+from .profiling import profile_stage
+
+# bump when the interaction rows change for the same inputs
+INTERACTIONS_FORMAT = 2
+
+def add_cache_arguments(argParser):
+    argParser.add_argument("--cache-dir", help="Directory of the perceived interaction cache (default=~/.cache/activesite)", dest="cache_dir",
+                           default=os.path.join(os.path.expanduser("~"), ".cache", "activesite"))
+    argParser.add_argument("--cache-size", help="Maximum size of the cache in MB, least recently used entries are evicted first (default=1024)", dest="cache_size", type=float, default=1024.0)
+    argParser.add_argument("--cache-hints", help="Also cache the perceived interaction hint containers as OEB", dest="cache_hints", action="store_true")
+    argParser.add_argument("--no-cache", help="Neither read nor write the cache", dest="no_cache", action="store_true")
+
+
+_file_hashes = {}
+
+def hash_input(source):
+    """
+    :param source: bytes, or path of a file whose content is hashed (once
+                   per process while the file is unchanged)
+    :rtype: str
+    """
+    if isinstance(source, bytes):
+        return hashlib.sha256(source).hexdigest()
+
+    st = os.stat(source)
+    filekey = (os.path.abspath(source), st.st_mtime, st.st_size)
+    if filekey not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        _file_hashes[filekey] = digest.hexdigest()
+    return _file_hashes[filekey]
+
+
+def hash_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+# fraction of the maximum size the cache is evicted down to, so that a full
+# cache is not scanned again on every new entry
+CACHE_LOW_WATER = 0.9
+
+class ResultCache(object):
+    """
+    Content-addressed on-disk cache. Entries are files named by key, their
+    modification time is refreshed on every hit and the least recently used
+    ones are evicted, down to CACHE_LOW_WATER of maxsize, once the cache
+    exceeds maxsize bytes. Concurrent
+    processes may share the directory since entries are written atomically.
+    """
+
+    def __init__(self, path, maxsize):
+        self.path = path
+        self.maxsize = maxsize
+        self.size = None
+
+    def GetPath(self, key, suffix):
+        return os.path.join(self.path, key[:2], key + suffix)
+
+    def Lookup(self, key, suffix):
+        path = self.GetPath(key, suffix)
+        try:
+            os.utime(path, None)
+        except OSError:
+            return None
+        return path
+
+    def Store(self, key, suffix, write):
+        """
+        :param write: function writing the entry into the file name it is given
+        """
+        path = self.GetPath(key, suffix)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        if not write(tmp):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return False
+        os.replace(tmp, path)
+
+        if self.size is None:
+            self.size = self.GetEntries()[1]
+        else:
+            self.size += os.path.getsize(path)
+        if self.size > self.maxsize:
+            self.Evict()
+        return True
+
+    def GetEntries(self):
+        """
+        :rtype: tuple (list of (mtime, size, path), total size)
+        """
+        entries = []
+        for root, dirs, files in os.walk(self.path):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries, sum(entry[1] for entry in entries)
+
+    def Evict(self):
+        entries, self.size = self.GetEntries()
+        for mtime, size, path in sorted(entries):
+            if self.size <= self.maxsize * CACHE_LOW_WATER:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+
+
+_caches = {}
+
+def open_cache(args):
+    """
+    :rtype: ResultCache or None when caching is disabled
+    """
+    if getattr(args, "no_cache", True):
+        return None
+    if args.cache_dir not in _caches:
+        _caches[args.cache_dir] = ResultCache(args.cache_dir, int(args.cache_size * 1024 * 1024))
+    return _caches[args.cache_dir]
+
+
+def get_hints_key(args, setup, inputs):
+    """
+    Key of the perceived hint container of the given inputs (bytes or
+    paths), split/receptor setup and perception parameters.
+    """
+    hashes = [hash_input(source) for source in inputs]
+    params = [getattr(args, name) for name in PERCEPTION_PARAMS]
+    return hash_key("hints", oechem.OEChemGetRelease(), setup, hashes, params)
+
+
+def get_interactions_key(hintskey, args):
+    subsites = None
+    if args.subsites == 1:
+        subsites = args.subsite_map
+        if subsites not in BUILTIN_SUBSITE_MAPS:
+            subsites = hash_input(subsites)
+    return hash_key("interactions", INTERACTIONS_FORMAT, hintskey, LIST_TYPE_CONTACTS, subsites)
+
+
+def load_cached_interactions(cache, key):
+    """
+    :rtype: list of interaction rows or None
+    """
+    path = cache.Lookup(key, ".jsonl.gz")
+    if path is None:
+        return None
+    with gzip.open(path, "rt") as f:
+        return [json.loads(line) for line in f]
+
+
+def store_cached_interactions(cache, key, interactions):
+    def write(path):
+        with gzip.open(path, "wt") as f:
+            for interaction in interactions:
+                f.write(json.dumps(interaction))
+                f.write("\n")
+        return True
+    return cache.Store(key, ".jsonl.gz", write)
+
+
+def load_cached_hints(cache, key):
+    """
+    :rtype: oechem.OEInteractionHintContainer or None
+    """
+    path = cache.Lookup(key, ".oeb")
+    if path is None:
+        return None
+    ifs = oechem.oemolistream()
+    if not ifs.open(path):
+        return None
+    return read_hints(ifs)
+
+
+def store_cached_hints(cache, key, asite):
+    def write(path):
+        ofs = oechem.oemolostream()
+        if not ofs.open(path):
+            return False
+        # the temporary file name does not tell the format
+        ofs.SetFormat(oechem.OEFormat_OEB)
+        ok = oechem.OEWriteInteractionHintContainer(ofs, asite)
+        ofs.close()
+        return ok
+    return cache.Store(key, ".oeb", write)
+
+
+def read_hints(ifs):
+    """
+    :type ifs: oechem.oemolistream
+    :rtype: oechem.OEInteractionHintContainer or None
+    """
+    asite = oechem.OEInteractionHintContainer()
+    if not oechem.OEReadInteractionHintContainer(ifs, asite) or not asite.IsValid():
+        return None
+    return asite
+
+
+def hints_to_bytes(asite):
+    """
+    :type asite: oechem.OEInteractionHintContainer
+    :rtype: bytes (OEB)
+    """
+    ofs = oechem.oemolostream()
+    ofs.SetFormat(oechem.OEFormat_OEB)
+    ofs.openstring()
+    oechem.OEWriteInteractionHintContainer(ofs, asite)
+    return ofs.GetString()
+
+
+def hints_from_bytes(data):
+    """
+    :rtype: oechem.OEInteractionHintContainer or None
+    """
+    ifs = oechem.oemolistream()
+    ifs.SetFormat(oechem.OEFormat_OEB)
+    ifs.openstring(data)
+    return read_hints(ifs)
+
+
+def extract_interactions(args, setup, inputs, perceive, *perceiveargs):
+    """
+    Returns the interaction rows of one complex, from the cache when
+    possible. perceive(*perceiveargs) is only called on a cache miss and
+    returns the perceived hint container, or None and an error message.
+
+    :rtype: tuple (iterable of interaction rows or None, error message)
+    """
+    cache = open_cache(args)
+    if cache is None:
+        asite, error = perceive(*perceiveargs)
+        if asite is None:
+            return None, error
+        return iter_protein_interactions(asite, LIST_TYPE_CONTACTS, get_subsite_map(args)), None
+
+    with profile_stage("cache"):
+        hintskey = get_hints_key(args, setup, inputs)
+        key = get_interactions_key(hintskey, args)
+        interactions = load_cached_interactions(cache, key)
+    if interactions is None:
+        asite, error = perceive(*perceiveargs)
+        if asite is None:
+            return None, error
+        if args.cache_hints:
+            store_cached_hints(cache, hintskey, asite)
+        interactions = list(iter_protein_interactions(asite, LIST_TYPE_CONTACTS, get_subsite_map(args)))
+        store_cached_interactions(cache, key, interactions)
+    return interactions, None
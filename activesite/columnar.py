@@ -0,0 +1,131 @@
+#############################################################################
+# Columnar output of the interactions of many complexes
+#############################################################################
+import array
+import json
+import os
+from .extraction import LIST_TYPE_CONTACTS
+from .records import StringTable, InteractionTable, make_table
+
+class ColumnarWriter(object):
+    """
+    Collects the interactions of many complexes into one InteractionTable,
+    along with the complex of each row, and writes them as a directory of
+    NumPy .npy arrays that can be memory-mapped by load_columnar:
+
+    - complex, resname, resid, chain, protatom, contact, subsite: one entry
+      per row, string columns being codes into tables.json (subsite -1 for None)
+    - ligatoms, ligatoms_offsets: ligand atom codes of row i are
+      ligatoms[ligatoms_offsets[i]:ligatoms_offsets[i + 1]]
+    - fingerprint (optional): one row of packed bits per complex, bit
+      residue * ncontact + contact set when that residue has that contact type,
+      residue being a code of the (resname, resid, chain) table
+    """
+
+    def __init__(self, path, fingerprint=False):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.rows = InteractionTable()
+        self.complexes = StringTable()
+        self.residues = StringTable()
+        self.complex = array.array("i")
+        self.fpbits = array.array("i")
+        self.fpoffsets = array.array("q", [0])
+
+    def Add(self, name, interactions):
+        """
+        :type interactions: InteractionTable, or iterator of dicts with the
+                            keys of the output FIELDS
+        """
+        if not isinstance(interactions, InteractionTable):
+            interactions = make_table(interactions, self.rows.tables)
+        rows = self.rows
+        start = len(rows)
+        rows.Extend(interactions)
+        self.complex.extend([self.complexes.Code(name)] * (len(rows) - start))
+        if self.fingerprint:
+            resname = rows.tables["resname"].strings
+            chain = rows.tables["chain"].strings
+            bits = set()
+            for i in range(start, len(rows)):
+                residue = self.residues.Code("%s %s %s" % (resname[rows.resname[i]], rows.resid[i],
+                                                           chain[rows.chain[i]]))
+                bits.add((residue, rows.contact[i]))
+            self.fpbits.extend(residue * len(LIST_TYPE_CONTACTS) + contact
+                               for residue, contact in sorted(bits))
+            self.fpoffsets.append(len(self.fpbits))
+
+    def Close(self):
+        np = import_numpy()
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        def save(name, values, dtype):
+            np.save(os.path.join(self.path, name + ".npy"), np.frombuffer(values, dtype=values.typecode).astype(dtype))
+
+        rows = self.rows
+        save("complex", self.complex, np.int32)
+        save("resname", rows.resname, np.int32)
+        save("resid", rows.resid, np.int32)
+        save("chain", rows.chain, np.int16)
+        save("protatom", rows.protatom, np.int32)
+        save("contact", rows.contact, np.int8)
+        save("subsite", rows.subsite, np.int16)
+        save("ligatoms", rows.ligatoms, np.int32)
+        save("ligatoms_offsets", rows.ligatoms_offsets, np.int64)
+
+        if self.fingerprint:
+            nbits = len(self.residues) * len(LIST_TYPE_CONTACTS)
+            ncomplex = len(self.fpoffsets) - 1
+            fp = np.lib.format.open_memmap(os.path.join(self.path, "fingerprint.npy"), mode="w+",
+                                           dtype=np.uint8, shape=(ncomplex, (nbits + 7) // 8))
+            fpbits = np.frombuffer(self.fpbits, dtype=self.fpbits.typecode)
+            for row in range(ncomplex):
+                dense = np.zeros(nbits, dtype=np.uint8)
+                dense[fpbits[self.fpoffsets[row]:self.fpoffsets[row + 1]]] = 1
+                fp[row] = np.packbits(dense)
+            fp.flush()
+            del fp
+
+        with open(os.path.join(self.path, "tables.json"), "w") as f:
+            tables = dict((name, table.strings) for name, table in rows.tables.items())
+            tables["complex"] = self.complexes.strings
+            tables["residue"] = self.residues.strings
+            tables["nbits"] = len(self.residues) * len(LIST_TYPE_CONTACTS) if self.fingerprint else 0
+            json.dump(tables, f)
+
+
+def import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("NumPy is required for the columnar output")
+    return numpy
+
+
+def load_columnar(path, mmap=True):
+    """
+    Loads a directory written by ColumnarWriter, memory-mapping the arrays
+    unless mmap is False.
+
+    :rtype: dict (array name -> numpy array, "tables" -> string tables)
+    """
+    np = import_numpy()
+    store = {}
+    for name in os.listdir(path):
+        if name.endswith(".npy"):
+            store[name[:-4]] = np.load(os.path.join(path, name), mmap_mode="r" if mmap else None)
+    with open(os.path.join(path, "tables.json")) as f:
+        store["tables"] = json.load(f)
+    return store
+
+
+def unpack_fingerprints(store, rows=slice(None)):
+    """
+    :rtype: numpy array of shape (ncomplex, nresidue, ncontact) of 0/1 values
+    """
+    np = import_numpy()
+    tables = store["tables"]
+    packed = store["fingerprint"][rows]
+    dense = np.unpackbits(packed, axis=-1, count=tables["nbits"])
+    return dense.reshape(dense.shape[:-1] + (len(tables["residue"]), len(tables["contact"])))
@@ -0,0 +1,187 @@
+#############################################################################
+# Comparison of the interactions of many poses against a reference pose or
+# crystal structure
+#############################################################################
+import collections
+import csv
+import heapq
+from openeye import oechem
+from .batch import (iter_batch_inputs, iter_pool_results, init_receptor, extract_batch_item, extract_ligand_item,
+                    get_error_message)
+from .perception import SPLIT_SETUP
+from .store import iter_prepared_inputs
+from .output import open_output
+from .profiling import start_profile, finish_profile, report_profiles
+
+DIFF_FIELDS = ["Name", "Interactions", "Recovered", "Missed", "New", "Similarity"]
+
+def add_diff_arguments(argParser):
+    argParser.add_argument("--reference", help="Reference complex (with --batch) or ligand pose (with --protein/--ligands) whose interactions every pose is compared to")
+    argParser.add_argument("--diff", help="Output of the recovered, missed and new interactions of each pose against --reference, gzip-compressed if it ends with .gz (default=diff.tsv)", dest="diffname", default="diff.tsv")
+    argParser.add_argument("--top", help="Also write the K poses most similar to --reference, best first, into --top-tsv (default=0)", type=int, default=0, metavar="K")
+    argParser.add_argument("--top-tsv", help="Output of the --top poses (default=top.tsv)", dest="topname", default="top.tsv")
+
+
+def get_interaction_key(interaction):
+    """
+    :rtype: tuple (residue number, chain ID, protein atom name, contact type)
+    """
+    return (interaction["ResID_Prot"], interaction["ChainID_Prot"], interaction["AtomName_Prot"],
+            interaction["ContactType"])
+
+
+def get_interaction_keys(interactions):
+    """
+    :type interactions: iterator of dict rows or InteractionTable
+    :rtype: frozenset of the keys of get_interaction_key
+    """
+    return frozenset(get_interaction_key(interaction) for interaction in interactions)
+
+
+# outcome of one pose: its position in the input, its interaction counts
+# against the reference, or error message, and profile record
+DiffResult = collections.namedtuple("DiffResult", ["name", "index", "count", "recovered", "missed", "new",
+                                                   "similarity", "error", "profile"])
+
+def compare_interaction_keys(name, reference, keys, profile=None, index=None):
+    """
+    :type reference: frozenset
+    :type keys: frozenset
+    :param index: position of the pose in the input
+    :rtype: DiffResult (similarity is the Tanimoto coefficient of the two sets)
+    """
+    recovered = len(reference & keys)
+    union = len(reference) + len(keys) - recovered
+    return DiffResult(name, index, len(keys), recovered, len(reference) - recovered, len(keys) - recovered,
+                      float(recovered) / union if union else 0.0, None, profile)
+
+
+def failed_diff(name, error, profile=None):
+    return DiffResult(name, None, None, None, None, None, None, error, profile)
+
+
+def get_diff_row(result):
+    return [result.name, result.count, result.recovered, result.missed, result.new, "%.4f" % result.similarity]
+
+
+#############################################################################
+# WORKERS
+#############################################################################
+
+# reference keys of the worker process, see init_diff
+_reference = None
+
+def init_diff(args, reference, receptor):
+    """
+    :param reference: keys of the reference interactions
+    :param receptor: True to prepare args.pname for the --ligands poses
+    """
+    global _reference
+    _reference = reference
+    if receptor:
+        init_receptor(args)
+
+
+def diff_batch_item(item, args):
+    """
+    :rtype: DiffResult of a complex against the reference
+    """
+    return diff_item(item, args, extract_batch_item)
+
+
+def diff_ligand_item(item, args):
+    """
+    :rtype: DiffResult of a ligand pose against the reference
+    """
+    return diff_item(item, args, extract_ligand_item)
+
+
+def diff_item(item, args, extract):
+    """
+    :param item: (name, path, data, position in the input) batch item
+    """
+    name, path, data, index = item
+    start_profile(args, name)
+    try:
+        interactions, error = extract((name, path, data), args)
+        if interactions is None:
+            return failed_diff(name, error, finish_profile())
+        keys = get_interaction_keys(interactions)
+    except Exception as err:
+        return failed_diff(name, get_error_message(err), finish_profile())
+    return compare_interaction_keys(name, _reference, keys, finish_profile(), index)
+
+
+#############################################################################
+# RUN
+#############################################################################
+
+def run_diff(args):
+    """
+    Perceives args.reference once, then streams the comparison of every pose
+    of args.batch, or of args.lname against args.pname, into args.diffname.
+    The args.top most similar poses are kept in a bounded heap, ties going
+    to the pose found first in the input whatever the completion order.
+    """
+    receptor = bool(args.pname)
+    if receptor:
+        init_receptor(args)
+        extract, worker, spec = extract_ligand_item, diff_ligand_item, args.lname
+    else:
+        extract, worker, spec = extract_batch_item, diff_batch_item, args.batch
+
+    interactions, error = extract(("reference", args.reference, None), args)
+    if interactions is None:
+        raise ValueError("%s: %s" % (args.reference, error))
+    reference = get_interaction_keys(interactions)
+    oechem.OEThrow.Info("%d reference interactions in %s" % (len(reference), args.reference))
+
+    inputs = iter_batch_inputs(spec)
+    if not receptor:
+        inputs = iter_prepared_inputs(args, inputs, SPLIT_SETUP)
+    inputs = (item + (index,) for index, item in enumerate(inputs))
+    if args.jobs <= 1:
+        init_diff(args, reference, False)
+        results = (worker(item, args) for item in inputs)
+    else:
+        results = iter_pool_results(args, worker, inputs, init_diff, (args, reference, receptor), failed_diff)
+    return report_diff(results, args)
+
+
+def report_diff(results, args):
+    nposes = 0
+    nfailed = 0
+    profiles = []
+    top = []
+    with open_output(args.diffname) as f:
+        writer = csv.writer(f, delimiter="\t")
+        writer.writerow(DIFF_FIELDS)
+        for result in results:
+            if result.profile is not None:
+                profiles.append(result.profile)
+            if result.error is not None:
+                nfailed += 1
+                oechem.OEThrow.Warning("%s: %s" % (result.name, result.error))
+                continue
+            nposes += 1
+            writer.writerow(get_diff_row(result))
+            if args.top > 0:
+                entry = (result.similarity, result.recovered, -result.new, -result.index, result)
+                if len(top) < args.top:
+                    heapq.heappush(top, entry)
+                else:
+                    heapq.heappushpop(top, entry)
+
+    if args.top > 0:
+        write_top_poses([entry[-1] for entry in sorted(top, reverse=True)], args.topname)
+    print("%d poses\t%d failed" % (nposes, nfailed))
+    report_profiles(args, profiles)
+    return 1 if nfailed else 0
+
+
+def write_top_poses(results, path):
+    with open_output(path) as f:
+        writer = csv.writer(f, delimiter="\t")
+        writer.writerow(DIFF_FIELDS)
+        for result in results:
+            writer.writerow(get_diff_row(result))
@@ -0,0 +1,289 @@
+#############################################################################
+# Active site map depiction
+#
+# oedepict and oegrapheme are imported by the functions that draw, so that
+# perception and extraction do not pay for loading them.
+#############################################################################
+import collections
+import os
+from openeye import oechem
+from .perception import perceive
+from .batch import (iter_batch_inputs, iter_pool_results, init_receptor, get_receptor_setup, perceive_complex,
+                    perceive_ligand, get_error_message)
+from .cache import open_cache, get_hints_key, load_cached_hints, store_cached_hints, hints_to_bytes, hints_from_bytes
+from .store import iter_prepared_inputs
+from .profiling import start_profile, finish_profile, profile_stage, report_profiles
+
+# split setup of the maps, covalent ligands being depicted as ligands
+MAP_SPLIT_SETUP = "ligname covlig"
+
+IMAGE_WIDTH = 900.0
+IMAGE_HEIGHT = 600.0
+
+def get_image_size():
+    """
+    :rtype: tuple (width, height)
+    """
+    return IMAGE_WIDTH, IMAGE_HEIGHT
+
+
+def is_image_format(ext, multipage=False):
+    from openeye import oedepict
+    if multipage:
+        return oedepict.OEIsRegisteredMultiPageImageFile(ext)
+    return oedepict.OEIsRegisteredImageFile(ext)
+
+
+def write_activesite_map(oname, asite, width, height):
+    """
+    :raises IOError: when oname cannot be opened for writing
+    """
+
+    from openeye import oedepict
+
+    ofs = oechem.oeofstream()
+    if not ofs.open(oname):
+        raise IOError("Cannot open output file %s!" % oname)
+
+    # depict active site maps
+
+    image = oedepict.OEImage(width, height)
+
+    render_activesite_maps(image, asite)
+
+    oedepict.OEDrawCurvedBorder(image, oedepict.OELightGreyPen, 10.0)
+
+    with profile_stage("write"):
+        oedepict.OEWriteImage(oname, image)
+
+
+def depict_activesite_maps(image, protein, ligand, opts=None):
+    """
+    :type image: oedepict.OEImageBase
+    :type protein: oechem.OEMolBase
+    :type ligand: oechem.OEMolBase
+    :type opts: PerceptionOptions
+    """
+
+    render_activesite_maps(image, perceive(protein, ligand, opts))
+
+
+def render_activesite_maps(image, asite):
+    """
+    :type image: oedepict.OEImageBase
+    :type asite: oechem.OEInteractionHintContainer
+    """
+
+    from openeye import oegrapheme
+
+    # depiction
+
+    with profile_stage("prepare"):
+        oegrapheme.OEPrepareActiveSiteDepiction(asite)
+    with profile_stage("render"):
+        oegrapheme.OERenderActiveSiteMaps(image, asite)
+
+
+#############################################################################
+# BATCH RENDERING
+#############################################################################
+
+# outcome of one batch item: error message, OEB bytes of the perceived
+# active site (multi-page output only) and profile record
+MapResult = collections.namedtuple("MapResult", ["name", "error", "data", "profile"])
+
+def failed_map(name, error, profile=None):
+    return MapResult(name, error, None, profile)
+
+
+def render_batch(args):
+    """
+    Renders the complexes of args.batch, or the ligands of args.lname against
+    args.pname, on a pool of args.jobs workers with a bounded queue.
+    Per-pose images are rendered by the workers. For a multi-page document
+    the workers perceive the active sites and the maps are drawn into the
+    pages in input order.
+    """
+    if args.multipage:
+        if not is_image_format(oechem.OEGetFileExtension(args.multipage), multipage=True):
+            raise ValueError("Unknown multi-page image type!")
+        grid = parse_grid(args.grid)
+        worker = perceive_map_item
+    else:
+        args.format = args.format or "svg"
+        if not is_image_format(args.format):
+            raise ValueError("Unknown image type!")
+        args.outdir = args.outdir or "."
+        if not os.path.isdir(args.outdir):
+            os.makedirs(args.outdir)
+        worker = render_map_item
+
+    initializer, initargs = None, ()
+    if not args.batch:
+        initializer, initargs = init_receptor, (args,)
+
+    inputs = iter_batch_inputs(args.batch or args.lname)
+    if args.batch:
+        inputs = iter_prepared_inputs(args, inputs, MAP_SPLIT_SETUP)
+    if initializer is not None:
+        initializer(*initargs)
+    if args.jobs <= 1:
+        results = (worker(item, args) for item in inputs)
+    else:
+        results = iter_pool_results(args, worker, inputs, initializer, initargs, failed_map,
+                                    ordered=bool(args.multipage))
+
+    if args.multipage:
+        nfailed, profiles = write_activesite_document(args.multipage, results, grid, args)
+    else:
+        nfailed, profiles = report_map_results(results)
+
+    report_profiles(args, profiles)
+    return 1 if nfailed else 0
+
+
+def parse_grid(grid):
+    """
+    :rtype: tuple (rows, cols)
+    :raises ValueError: when grid is not ROWSxCOLS
+    """
+    try:
+        rows, cols = [int(n) for n in grid.lower().split("x")]
+    except ValueError:
+        raise ValueError("Invalid grid %s, expected ROWSxCOLS" % grid)
+    if rows < 1 or cols < 1:
+        raise ValueError("Invalid grid %s, expected ROWSxCOLS" % grid)
+    return rows, cols
+
+
+def get_item_activesite(item, args):
+    """
+    Perceives the active site of one batch item: a complex, or a ligand
+    paired with the receptor prepared by init_receptor.
+
+    :rtype: tuple (oechem.OEInteractionHintContainer or None, error message)
+    """
+    name, path, data = item
+    source = data if data is not None else path
+    if args.batch:
+        setup, inputs = MAP_SPLIT_SETUP, [source]
+    else:
+        setup, inputs = get_receptor_setup(args), [args.pname, source]
+
+    cache = open_cache(args)
+    if cache is not None:
+        key = get_hints_key(args, setup, inputs)
+        asite = load_cached_hints(cache, key)
+        if asite is not None:
+            return asite, None
+
+    if args.batch:
+        asite, error = perceive_complex(path, data, args, MAP_SPLIT_SETUP)
+    else:
+        asite, error = perceive_ligand(path, data, args)
+    if asite is not None and cache is not None:
+        store_cached_hints(cache, key, asite)
+    return asite, error
+
+
+def render_map_item(item, args):
+    """
+    Perceives and renders one batch item into args.outdir.
+
+    :rtype: MapResult
+    """
+    name = item[0]
+    start_profile(args, name)
+    try:
+        asite, error = get_item_activesite(item, args)
+        if asite is not None:
+            width, height = get_image_size()
+            write_activesite_map(os.path.join(args.outdir, "%s.%s" % (name, args.format)), asite, width, height)
+    except Exception as err:
+        error = get_error_message(err)
+    return MapResult(name, error, None, finish_profile())
+
+
+def perceive_map_item(item, args):
+    """
+    Perceives one batch item and returns its active site as OEB bytes.
+
+    :rtype: MapResult
+    """
+    name = item[0]
+    start_profile(args, name)
+    data = None
+    try:
+        asite, error = get_item_activesite(item, args)
+        if asite is not None:
+            data = hints_to_bytes(asite)
+    except Exception as err:
+        error = get_error_message(err)
+    return MapResult(name, error, data, finish_profile())
+
+
+def report_map_results(results):
+    """
+    :rtype: tuple (number of failures, profile records)
+    """
+    nfailed = 0
+    profiles = []
+    for result in results:
+        if result.profile is not None:
+            profiles.append(result.profile)
+        if result.error is not None:
+            nfailed += 1
+            oechem.OEThrow.Warning("%s: %s" % (result.name, result.error))
+        else:
+            print(result.name)
+    return nfailed, profiles
+
+
+def write_activesite_document(oname, results, grid, args):
+    """
+    Draws the active site maps of the results into the cells of a ROWSxCOLS
+    grid on each page of a multi-page document.
+
+    :rtype: tuple (number of failures, profile records)
+    """
+    from openeye import oedepict
+
+    rows, cols = grid
+    width, height = get_image_size()
+    multi = oedepict.OEMultiPageImageFile(width * cols, height * rows)
+    cells = iter(())
+
+    nfailed = 0
+    profiles = []
+    for result in results:
+        if result.error is not None:
+            nfailed += 1
+            oechem.OEThrow.Warning("%s: %s" % (result.name, result.error))
+            continue
+
+        # the drawing stages are added to the profile record of the worker
+
+        asite = hints_from_bytes(result.data)
+        if asite is None:
+            nfailed += 1
+            oechem.OEThrow.Warning("%s: Cannot read perceived active site!" % result.name)
+            continue
+
+        start_profile(args, result.name)
+        cell = next(cells, None)
+        if cell is None:
+            cells = iter(oedepict.OEImageGrid(multi.NewPage(), rows, cols).GetCells())
+            cell = next(cells)
+        render_activesite_maps(cell, asite)
+        oedepict.OEDrawCurvedBorder(cell, oedepict.OELightGreyPen, 10.0)
+        print(result.name)
+
+        record = finish_profile()
+        if result.profile is not None:
+            if record is not None:
+                result.profile["stages"].update(record["stages"])
+            profiles.append(result.profile)
+
+    with profile_stage("write"):
+        oedepict.OEWriteMultiPageImage(oname, multi)
+    return nfailed, profiles
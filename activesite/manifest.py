@@ -0,0 +1,87 @@
+#############################################################################
+# Append-only checkpoint manifest of the batch runs
+#############################################################################
+import json
+import os
+import time
+from .cache import hash_input
+
+def add_manifest_arguments(argParser):
+    argParser.add_argument("--manifest", help="Append-only record of the outcome of each batch item (default=<outdir>/manifest.jsonl)")
+    argParser.add_argument("--resume", help="Skip the batch items recorded as done in --manifest with the same inputs and parameters", action="store_true")
+
+
+class BatchManifest(object):
+    """
+    Records the outcome of each batch item as one JSON object per line,
+    flushed as soon as the item completes:
+
+    {"name": ..., "input": path, "input_hash": sha256 of the complex, "key": interactions key,
+     "status": "done" or "failed", "error": message or null, "count": rows or null,
+     "outputs": [TSV path, JSONL path], "time": seconds since the epoch}
+
+    The last record of a name wins. A run killed midway leaves a manifest
+    from which a resumed run skips the items already done.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.done = {}
+        self.items = {}
+        self.nskipped = 0
+        if resume and os.path.exists(path):
+            self.done = self.ReadDone(path)
+        self.f = open(path, "a")
+
+    @staticmethod
+    def ReadDone(path):
+        """
+        :rtype: dict (name -> (key, outputs) of the items last recorded as done)
+        """
+        done = {}
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # line truncated by a killed run
+                    continue
+                if record.get("status") == "done":
+                    done[record["name"]] = (record.get("key"), record.get("outputs", []))
+                else:
+                    done.pop(record.get("name"), None)
+        return done
+
+    def Pending(self, items, getkey, getoutputs):
+        """
+        Yields the (name, path, data) batch items that are not done yet,
+        remembering their input hash and key for Record.
+
+        :param getkey: function of an item returning the key of its results
+        :param getoutputs: function of a name returning its output paths
+        """
+        for item in items:
+            name, path, data = item
+            key = getkey(item)
+            if name in self.done:
+                donekey, outputs = self.done[name]
+                if donekey == key and outputs == list(getoutputs(name)) and all(os.path.exists(o) for o in outputs):
+                    self.nskipped += 1
+                    continue
+            source = data if data is not None else path
+            self.items[name] = (path, hash_input(source), key)
+            yield item
+
+    def Record(self, name, error, count, outputs):
+        path, inputhash, key = self.items.pop(name, (None, None, None))
+        record = {"name": name, "input": path, "input_hash": inputhash, "key": key,
+                  "status": "done" if error is None else "failed", "error": error,
+                  "count": count, "outputs": list(outputs), "time": time.time()}
+        self.f.write(json.dumps(record))
+        self.f.write("\n")
+        self.f.flush()
+
+    def Close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
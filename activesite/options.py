@@ -0,0 +1,54 @@
+#############################################################################
+# Interaction perception options
+#############################################################################
+import dataclasses
+
+
+@dataclasses.dataclass
+class PerceptionOptions(object):
+    """
+    Distance cutoffs of the interaction perception, in Angstroms except for
+    the contact fractions (distance over the sum of the van der Waals radii).
+    Any object with these attributes, such as the parsed command line, may be
+    passed where a PerceptionOptions is expected.
+    """
+    hbond: float = 3.2
+    hbondni: float = 3.8
+    hbondca: float = 3.5
+    halogenbond: float = 3.2
+    pistack: float = 5.0
+    tstack: float = 5.35
+    saltbridge: float = 5.0
+    cationpi: float = 5.5
+    contact: float = 1.2
+    clashcontact: float = 0.8
+
+    @classmethod
+    def FromArgs(cls, args):
+        """
+        :rtype: PerceptionOptions with the cutoffs of args
+        """
+        return cls(**dict((name, getattr(args, name)) for name in PERCEPTION_PARAMS))
+
+
+PERCEPTION_PARAMS = [field.name for field in dataclasses.fields(PerceptionOptions)]
+
+PERCEPTION_HELP = {
+    "hbond": "Maximum Distance of Hydrogen Bond",
+    "hbondni": "Maximum Distance of Non-Ideal Hydrogen Bond",
+    "hbondca": "Maximum Distance of Charge-Aided Hydrogen Bond",
+    "halogenbond": "Maximum Distance of Halogen Bond",
+    "pistack": "Maximum Distance of Pi-Stacking",
+    "tstack": "Maximum Distance of T-Stacking",
+    "saltbridge": "Maximum Distance of Salt Bridge",
+    "cationpi": "Maximum Distance of Cation-Pi",
+    "contact": "Maximum Distance of Contacts",
+    "clashcontact": "Minimum Distance of Contacts",
+}
+
+def add_perception_arguments(argParser):
+    defaults = PerceptionOptions()
+    for name in PERCEPTION_PARAMS:
+        default = getattr(defaults, name)
+        argParser.add_argument("--" + name, help="%s (default=%gA)" % (PERCEPTION_HELP[name], default),
+                               type=float, default=default)
@@ -0,0 +1,79 @@
+#############################################################################
+# TSV and newline-delimited JSON output of the interactions
+#############################################################################
+import csv
+import gzip
+import json
+from .profiling import profile_stage, profile_count
+from .extraction import iter_protein_interactions
+
+FIELDS = ["ResName_Prot","ResID_Prot","ChainID_Prot","AtomName_Prot","AtomsName_Lig","ContactType","Subsite"]
+
+OUTPUT_BUFFER_SIZE = 1 << 16
+
+def open_output(path):
+    """
+    Opens a buffered text output, gzip-compressed when path ends with .gz
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, "wt", newline="")
+    return open(path, "w", newline="", buffering=OUTPUT_BUFFER_SIZE)
+
+
+class InteractionWriter(object):
+    """
+    Writes interaction rows as they are produced, as TSV and/or newline
+    delimited JSON (one object per line). An empty or None path disables
+    that output.
+    """
+
+    def __init__(self, tsvname="interactions.tsv", jsonname="interactions.jsonl"):
+        self.ftsv = None
+        self.fjson = None
+        self.writer_tsv = None
+        self.count = 0
+        if tsvname:
+            self.ftsv = open_output(tsvname)
+            self.writer_tsv = csv.DictWriter(self.ftsv, FIELDS, delimiter='\t')
+            self.writer_tsv.writeheader()
+        if jsonname:
+            self.fjson = open_output(jsonname)
+
+    def Write(self, interaction):
+        if self.writer_tsv is not None:
+            self.writer_tsv.writerow(interaction)
+        if self.fjson is not None:
+            self.fjson.write(json.dumps(interaction))
+            self.fjson.write("\n")
+        self.count += 1
+
+    def Close(self):
+        for f in (self.ftsv, self.fjson):
+            if f is not None:
+                f.close()
+        self.ftsv = self.fjson = self.writer_tsv = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.Close()
+        return False
+
+
+def get_protein_interactions(asite,list_type_contacts,subsites,tsvname="interactions.tsv",jsonname="interactions.jsonl"):
+    """
+    Streams the interactions of the active site into tsvname and jsonname.
+
+    :rtype: int (number of interactions written)
+    """
+    return write_interactions(iter_protein_interactions(asite, list_type_contacts, subsites), tsvname, jsonname)
+
+
+def write_interactions(interactions, tsvname="interactions.tsv", jsonname="interactions.jsonl"):
+    with profile_stage("write"):
+        with InteractionWriter(tsvname, jsonname) as writer:
+            for interaction in interactions:
+                writer.Write(interaction)
+    profile_count(interactions=writer.count)
+    return writer.count
@@ -0,0 +1,350 @@
+#############################################################################
+# Complex splitting, receptor preparation and interaction perception
+#############################################################################
+from openeye import oechem
+from .options import PerceptionOptions
+from .profiling import profile_stage, profile_count
+
+# split setups by the tag recorded in the cache keys, see get_hints_key:
+# the interaction tables keep covalent ligands with the protein, the maps
+# depict them as ligands
+SPLIT_SETUPS = {
+    "ligname": oechem.OESplitMolComplexSetup_LigName,
+    "ligname covlig": oechem.OESplitMolComplexSetup_LigName | oechem.OESplitMolComplexSetup_CovLig,
+}
+
+SPLIT_SETUP = "ligname"
+
+def get_split_options(setup=SPLIT_SETUP):
+    """
+    :param setup: key of SPLIT_SETUPS
+    :rtype: oechem.OESplitMolComplexOptions
+    """
+    itf = oechem.OEInterface()
+    oechem.OEConfigureSplitMolComplexOptions(itf, SPLIT_SETUPS[setup])
+
+    sopts = oechem.OESplitMolComplexOptions()
+    oechem.OESetupSplitMolComplexOptions(sopts, itf)
+    return sopts
+
+
+def split_complex(protein, ligand, sopts, complexmol):
+    """
+    Splits the complex into ligand and protein, waters being kept with the
+    protein.
+
+    :type complexmol: oechem.OEMolBase
+    :rtype: bool
+    """
+    if not oechem.OEHasResidues(complexmol):
+        with profile_stage("residues"):
+            oechem.OEPerceiveResidues(complexmol, oechem.OEPreserveResInfo_All)
+
+    water = oechem.OEGraphMol()
+    other = oechem.OEGraphMol()
+
+    pfilter = sopts.GetProteinFilter()
+    wfilter = sopts.GetWaterFilter()
+    sopts.SetProteinFilter(oechem.OEOrRoleSet(pfilter, wfilter))
+    sopts.SetWaterFilter(
+          oechem.OEMolComplexFilterFactory(oechem.OEMolComplexFilterCategory_Nothing))
+
+    with profile_stage("split"):
+        oechem.OESplitMolComplex(ligand, protein, water, other, complexmol, sopts)
+
+    return ligand.NumAtoms() != 0 and protein.NumAtoms() != 0
+
+
+def split(complexmol, setup=SPLIT_SETUP):
+    """
+    :type complexmol: oechem.OEMolBase
+    :rtype: tuple (protein, ligand) or None when the complex cannot be separated
+    """
+    protein = oechem.OEGraphMol()
+    ligand = oechem.OEGraphMol()
+    if not split_complex(protein, ligand, get_split_options(setup), complexmol):
+        return None
+    return protein, ligand
+
+
+def read_receptor(pname):
+    """
+    Reads the receptor, perceiving its residues if needed. Every molecule of
+    the file, waters included, is kept in the protein component.
+
+    :rtype: oechem.OEGraphMol
+    :raises IOError: when no protein can be read from pname
+    """
+    ifs = oechem.oemolistream()
+    if not ifs.open(pname):
+        raise IOError("Unable to open %s for reading" % pname)
+
+    protein = oechem.OEGraphMol()
+    if not oechem.OEReadMolecule(ifs, protein):
+        raise IOError("Unable to read protein from %s" % pname)
+
+    if not oechem.OEHasResidues(protein):
+        with profile_stage("residues"):
+            oechem.OEPerceiveResidues(protein, oechem.OEPreserveResInfo_All)
+    return protein
+
+
+class AtomIdxSelection(oechem.OEUnaryAtomPred):
+    def __init__(self, idxs):
+        oechem.OEUnaryAtomPred.__init__(self)
+        self.idxs = idxs
+
+    def __call__(self, atom):
+        return atom.GetIdx() in self.idxs
+
+    def CreateCopy(self):
+        return AtomIdxSelection(self.idxs).__disown__()
+
+
+# protein atoms per block of the vectorized distance test, bounding its
+# memory to POCKET_BLOCK x ligand atoms distances
+POCKET_BLOCK = 4096
+
+class PocketSelector(object):
+    """
+    Selector of the whole receptor residues lying within radius of any atom
+    of a ligand, built once per receptor and queried per ligand. The
+    distances are tested with NumPy on the receptor atoms within the ligand
+    bounding box, or on a spatial hash when NumPy is not installed. When the
+    receptor atoms move (e.g. over the frames of a trajectory), UpdateCoords
+    refreshes the coordinates while the residues are kept.
+    """
+
+    def __init__(self, protein, radius):
+        """
+        :type protein: oechem.OEMolBase
+        :type radius: float
+        """
+        self.protein = protein
+        self.radius = radius
+        self.cells = None
+        self.xyz = None
+        self.residues = []
+        self.atomresidue = {}
+
+        reskeys = {}
+        for atom in protein.GetAtoms():
+            res = oechem.OEAtomGetResidue(atom)
+            key = (res.GetChainID(), res.GetResidueNumber(), res.GetInsertCode(), res.GetName())
+            if key not in reskeys:
+                reskeys[key] = len(self.residues)
+                self.residues.append([])
+            self.residues[reskeys[key]].append(atom.GetIdx())
+            self.atomresidue[atom.GetIdx()] = reskeys[key]
+
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+
+        self.numpy = numpy
+        if numpy is not None:
+            self.idxs = sorted(self.atomresidue)
+            self.xyzresidue = numpy.array([self.atomresidue[idx] for idx in self.idxs], dtype=numpy.int64)
+        self.UpdateCoords()
+
+    def UpdateCoords(self):
+        """
+        Reads the current coordinates of the receptor atoms.
+        """
+        coords = self.protein.GetCoords()
+        if self.numpy is not None:
+            self.xyz = self.numpy.array([coords[idx] for idx in self.idxs], dtype=self.numpy.float64).reshape(-1, 3)
+        else:
+            self.cells = {}
+            for idx, xyz in coords.items():
+                self.cells.setdefault(self.Cell(xyz), []).append((idx, xyz))
+
+    def Cell(self, xyz):
+        return (int(xyz[0] // self.radius), int(xyz[1] // self.radius), int(xyz[2] // self.radius))
+
+    def Select(self, ligand):
+        """
+        :rtype: set of receptor atom indices
+        """
+        if self.xyz is not None:
+            hitres = self.SelectResiduesVectorized(ligand)
+        else:
+            hitres = self.SelectResiduesHashed(ligand)
+        idxs = set()
+        for res in hitres:
+            idxs.update(self.residues[res])
+        return idxs
+
+    def SelectResiduesVectorized(self, ligand):
+        np = self.numpy
+        lxyz = np.array(list(ligand.GetCoords().values()), dtype=np.float64).reshape(-1, 3)
+        if len(lxyz) == 0 or len(self.xyz) == 0:
+            return set()
+
+        inbox = ((self.xyz >= lxyz.min(axis=0) - self.radius) &
+                 (self.xyz <= lxyz.max(axis=0) + self.radius)).all(axis=1)
+        candidates = np.nonzero(inbox)[0]
+
+        r2 = self.radius * self.radius
+        hit = np.zeros(len(candidates), dtype=bool)
+        for start in range(0, len(candidates), POCKET_BLOCK):
+            block = self.xyz[candidates[start:start + POCKET_BLOCK]]
+            d2 = ((block[:, np.newaxis, :] - lxyz[np.newaxis, :, :]) ** 2).sum(axis=2)
+            hit[start:start + POCKET_BLOCK] = (d2 <= r2).any(axis=1)
+        return set(np.unique(self.xyzresidue[candidates[hit]]).tolist())
+
+    def SelectResiduesHashed(self, ligand):
+        r2 = self.radius * self.radius
+        hitres = set()
+        for lxyz in ligand.GetCoords().values():
+            cx, cy, cz = self.Cell(lxyz)
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for dz in (-1, 0, 1):
+                        for idx, xyz in self.cells.get((cx + dx, cy + dy, cz + dz), ()):
+                            if self.atomresidue[idx] in hitres:
+                                continue
+                            d2 = (xyz[0] - lxyz[0]) ** 2 + (xyz[1] - lxyz[1]) ** 2 + (xyz[2] - lxyz[2]) ** 2
+                            if d2 <= r2:
+                                hitres.add(self.atomresidue[idx])
+        return hitres
+
+    def Crop(self, ligand):
+        """
+        Crops the receptor to the residues within radius of the ligand.
+
+        :type ligand: oechem.OEMolBase
+        :rtype: oechem.OEMolBase, or None when no residue lies within radius
+                (see perceive_pocket)
+        """
+        idxs = self.Select(ligand)
+        if not idxs:
+            return None
+        pocket = oechem.OEGraphMol()
+        oechem.OESubsetMol(pocket, self.protein, AtomIdxSelection(idxs))
+        return pocket
+
+
+#############################################################################
+# PRE-FILTER
+#############################################################################
+
+# cutoffs of PerceptionOptions given as distances, contact and clashcontact
+# being fractions of the sum of the van der Waals radii
+DISTANCE_PARAMS = ["hbond", "hbondni", "hbondca", "halogenbond", "pistack", "tstack", "saltbridge", "cationpi"]
+
+# stacking and cation-pi cutoffs apply to ring centroids, the ring atoms
+# lying up to about 1.5A away from them on either side
+PREFILTER_MARGIN = 3.0
+
+# upper bound of the van der Waals radii that scale the contact fraction
+MAX_VDW_RADIUS = 2.2
+
+def get_prefilter_radius(opts, margin=PREFILTER_MARGIN):
+    """
+    Distance to the ligand beyond which no protein atom can take part in an
+    interaction perceived with opts.
+
+    :type opts: PerceptionOptions
+    :rtype: float
+    """
+    cutoff = max(getattr(opts, name) for name in DISTANCE_PARAMS)
+    return max(cutoff, 2.0 * MAX_VDW_RADIUS * opts.contact) + margin
+
+
+def add_prefilter_arguments(argParser):
+    argParser.add_argument("--prefilter", help="Crop the protein to the residues within reach of the ligand before perception", action="store_true")
+    argParser.add_argument("--prefilter-margin", help="Margin added to the largest cutoff to crop the protein before perception (default=%gA)" % PREFILTER_MARGIN,
+                           dest="prefilter_margin", type=float, default=PREFILTER_MARGIN)
+
+
+def get_prefilter(args):
+    """
+    :rtype: float (pre-filter radius of args, 0 when disabled)
+    """
+    if not getattr(args, "prefilter", False):
+        return 0.0
+    return get_prefilter_radius(args, args.prefilter_margin)
+
+
+def crop_pocket(protein, ligand, radius):
+    """
+    Crops the protein to the whole residues within radius of the ligand,
+    which leaves the perceived interactions unchanged when radius is at
+    least get_prefilter_radius of the perception options.
+
+    :rtype: oechem.OEMolBase, or None when no residue lies within radius
+    """
+    with profile_stage("pocket"):
+        return PocketSelector(protein, radius).Crop(ligand)
+
+
+def get_perceive_options(opts):
+    """
+    :type opts: PerceptionOptions
+    :rtype: oechem.OEPerceiveInteractionOptions
+    """
+    popts = oechem.OEPerceiveInteractionOptions()
+    popts.SetMaxHBondDistance(opts.hbond) # Default : 3.2A
+    popts.SetMaxNonIdealHBondDistance(opts.hbondni) # Default : 3.8A
+    popts.SetMaxChargeAidedHBondDistance(opts.hbondca) # Default : 3.5A
+    popts.SetMaxContactFraction(opts.contact) # Default : 1.2
+    popts.SetMaxHalogenBondDistance(opts.halogenbond) # Default : 3.2A
+    popts.SetMaxPiStackDistance(opts.pistack) # Default : 5.0A
+    popts.SetMaxTStackDistance(opts.tstack) # Default : 5.35A
+    popts.SetMaxSaltBridgeDistance(opts.saltbridge) # Default : 5.0A
+    popts.SetMaxCationPiDistance(opts.cationpi) # Default : 5.5A
+    popts.SetMinContactFraction(opts.clashcontact) # Default : 0.8
+    return popts
+
+
+def perceive(protein, ligand, opts=None):
+    """
+    Perceives the interactions between protein and ligand. The active site
+    is titled after the ligand.
+
+    :type protein: oechem.OEMolBase
+    :type ligand: oechem.OEMolBase
+    :type opts: PerceptionOptions (default cutoffs when None)
+    :rtype: oechem.OEInteractionHintContainer
+    :raises ValueError: when protein and ligand do not make a valid active site
+    """
+    if opts is None:
+        opts = PerceptionOptions()
+
+    asite = oechem.OEInteractionHintContainer()
+    asite.AddMolecule(protein, oechem.OEProteinInteractionHintComponent())
+    asite.AddMolecule(ligand, oechem.OELigandInteractionHintComponent())
+    if not oechem.OEIsValidActiveSite(asite):
+        raise ValueError("Cannot initialize active site!")
+    asite.SetTitle(ligand.GetTitle())
+
+    with profile_stage("perceive"):
+        oechem.OEPerceiveInteractionHints(asite, get_perceive_options(opts))
+    profile_count(protein_atoms=protein.NumAtoms(), ligand_atoms=ligand.NumAtoms())
+
+    return asite
+
+
+def perceive_pocket(protein, pocket, ligand, opts=None):
+    """
+    Perceives the interactions between the pocket cropped from protein and
+    the ligand. A ligand with no residue within reach (pocket None) has no
+    interaction: its active site is built with protein but without
+    perceiving anything, since an empty pocket is not a valid active site.
+
+    :type protein: oechem.OEMolBase
+    :param pocket: see PocketSelector.Crop
+    :type ligand: oechem.OEMolBase
+    :rtype: oechem.OEInteractionHintContainer
+    :raises ValueError: when pocket and ligand do not make a valid active site
+    """
+    if pocket is not None:
+        return perceive(pocket, ligand, opts)
+    asite = oechem.OEInteractionHintContainer()
+    asite.AddMolecule(protein, oechem.OEProteinInteractionHintComponent())
+    asite.AddMolecule(ligand, oechem.OELigandInteractionHintComponent())
+    asite.SetTitle(ligand.GetTitle())
+    profile_count(protein_atoms=0, ligand_atoms=ligand.NumAtoms())
+    return asite
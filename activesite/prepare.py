@@ -0,0 +1,114 @@
+#############################################################################
+# Preparation of complexes and receptors into a prepared-structure store
+#############################################################################
+import collections
+from openeye import oechem
+from .perception import SPLIT_SETUPS, SPLIT_SETUP, split, read_receptor
+from .batch import iter_batch_inputs, iter_pool_results, read_batch_item, get_error_message, get_input_stem
+from .store import StructureStore, RECEPTOR_SETUP, get_entry_hash
+from .profiling import start_profile, finish_profile, profile_stage, report_profiles
+
+def add_prepare_arguments(argParser):
+    argParser.add_argument("--prepare", help="Split the complexes of --complex or --batch, and the receptor of --protein, into this prepared-structure store to be read back with --store", metavar="STORE")
+    argParser.add_argument("--prepare-setup", help="Split setup of the prepared complexes, 'ligname covlig' for activesitemaps2img.py (default=%s)" % SPLIT_SETUP,
+                           dest="prepare_setup", choices=sorted(SPLIT_SETUPS), default=SPLIT_SETUP)
+
+
+# outcome of one prepared complex: OEB bytes of its protein and ligand or
+# error message, and profile record
+PrepareResult = collections.namedtuple("PrepareResult", ["name", "path", "hash", "protein", "ligand", "error", "profile"])
+
+def failed_prepare(name, error, profile=None):
+    return PrepareResult(name, None, None, None, None, error, profile)
+
+
+def prepare_item(item, args):
+    """
+    Reads and splits one complex in a worker.
+
+    :param item: (name, path, data, hash of the entry) batch item
+
+    :rtype: PrepareResult
+    """
+    name, path, data, inputhash = item
+    start_profile(args, name)
+    try:
+        complexmol = oechem.OEGraphMol()
+        with profile_stage("read"):
+            ok = read_batch_item(complexmol, path, data)
+        if not ok:
+            return failed_prepare(name, "Unable to read molecule from %s" % path, finish_profile())
+        parts = split(complexmol, args.prepare_setup)
+        if parts is None:
+            return failed_prepare(name, "Cannot separate complex!", finish_profile())
+        protein, ligand = parts
+        return PrepareResult(name, path, inputhash,
+                             oechem.OEWriteMolToBytes(".oeb", protein), oechem.OEWriteMolToBytes(".oeb", ligand),
+                             None, finish_profile())
+    except Exception as err:
+        return failed_prepare(name, get_error_message(err), finish_profile())
+
+
+def run_prepare(args):
+    """
+    Adds the receptor of args.pname and the complexes of args.iname or
+    args.batch to the store args.prepare, skipping those already prepared.
+    """
+    store = StructureStore(args.prepare, write=True)
+    try:
+        if args.pname:
+            prepare_receptor(store, args.pname)
+        if args.iname:
+            items = [(get_input_stem(args.iname), args.iname, None)]
+        elif args.batch:
+            items = iter_batch_inputs(args.batch)
+        else:
+            return 0
+
+        nskipped = [0]
+        def pending(items):
+            # the molecules of a multi-molecule file are keyed by the hash of
+            # the file and their position, so that the file is hashed once
+            for n, (name, path, data) in enumerate(items, 1):
+                inputhash = get_entry_hash(path, n if data is not None else None)
+                if store.Lookup(inputhash, args.prepare_setup) is not None:
+                    nskipped[0] += 1
+                    continue
+                yield name, path, data, inputhash
+
+        if args.jobs <= 1:
+            results = (prepare_item(item, args) for item in pending(items))
+        else:
+            results = iter_pool_results(args, prepare_item, pending(items), failed=failed_prepare)
+        status = report_prepare(results, store, args)
+        if nskipped[0]:
+            oechem.OEThrow.Info("%d complex(es) already prepared in %s were skipped" % (nskipped[0], args.prepare))
+        return status
+    finally:
+        store.Close()
+
+
+def prepare_receptor(store, pname):
+    inputhash = get_entry_hash(pname)
+    if store.Lookup(inputhash, RECEPTOR_SETUP) is not None:
+        oechem.OEThrow.Info("%s already prepared in %s" % (pname, store.path))
+        return
+    protein = read_receptor(pname)
+    store.Add(get_input_stem(pname), pname, inputhash, RECEPTOR_SETUP, oechem.OEWriteMolToBytes(".oeb", protein))
+    print("%s\tprepared" % get_input_stem(pname))
+
+
+def report_prepare(results, store, args):
+    nfailed = 0
+    profiles = []
+    for result in results:
+        if result.profile is not None:
+            profiles.append(result.profile)
+        if result.error is not None:
+            nfailed += 1
+            oechem.OEThrow.Warning("%s: %s" % (result.name, result.error))
+            continue
+        store.Add(result.name, result.path, result.hash, args.prepare_setup, result.protein, result.ligand)
+        print("%s\tprepared" % result.name)
+    report_profiles(args, profiles)
+    return 1 if nfailed else 0
@@ -0,0 +1,174 @@
+#############################################################################
+# Per-stage wall/CPU time and peak RSS recording
+#############################################################################
+import sys
+import contextlib
+import cProfile
+import json
+import math
+import os
+import resource
+import time
+
+PROFILE_PERCENTILES = [50, 90, 99]
+
+def add_profile_arguments(argParser):
+    argParser.add_argument("--profile", help="Record wall/CPU time and peak RSS per stage and print percentile summaries to stderr", action="store_true")
+    argParser.add_argument("--profile-json", help="Write the per-complex profile records and their summary to this JSON sidecar (implies --profile)", dest="profile_json")
+    argParser.add_argument("--cprofile", help="Dump cProfile statistics into this file (suffixed by the process ID in batch workers)")
+
+
+class StageProfiler(object):
+    """
+    Per-process recorder of the wall time, CPU time and peak RSS of the
+    pipeline stages of each complex, along with atom/hint counts. Stages run
+    outside of a complex (e.g. receptor preparation) are attached to the
+    next complex.
+    """
+
+    def __init__(self, cprofile=None):
+        self.record = None
+        self.pending = {}
+        self.cprofile = cprofile
+        self.cprofiler = None
+
+    def Start(self, name):
+        self.record = {"name": name, "pid": os.getpid(), "stages": self.pending, "counts": {}}
+        self.pending = {}
+        if self.cprofile:
+            if self.cprofiler is None:
+                self.cprofiler = cProfile.Profile()
+            self.cprofiler.enable()
+
+    @contextlib.contextmanager
+    def Stage(self, name):
+        stages = self.record["stages"] if self.record is not None else self.pending
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            stage = stages.setdefault(name, {"wall": 0.0, "cpu": 0.0})
+            stage["wall"] += time.perf_counter() - wall
+            stage["cpu"] += time.process_time() - cpu
+            stage["maxrss_kb"] = get_maxrss_kb()
+
+    def Count(self, **counts):
+        if self.record is not None:
+            self.record["counts"].update(counts)
+
+    def Finish(self):
+        record, self.record = self.record, None
+        if self.cprofiler is not None:
+            self.cprofiler.disable()
+            self.cprofiler.dump_stats(self.cprofile)
+        return record
+
+
+def get_maxrss_kb():
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss // 1024 if sys.platform == "darwin" else maxrss
+
+
+_profiler = None
+
+def get_profiler(args):
+    """
+    :rtype: StageProfiler or None when profiling is disabled
+    """
+    global _profiler
+    if _profiler is None and (getattr(args, "profile", False) or getattr(args, "profile_json", None) or
+                              getattr(args, "cprofile", None)):
+        cprofile = args.cprofile
+        if cprofile and getattr(args, "jobs", 1) > 1:
+            cprofile = "%s.%d" % (cprofile, os.getpid())
+        _profiler = StageProfiler(cprofile)
+    return _profiler
+
+
+def start_profile(args, name):
+    if get_profiler(args) is not None:
+        _profiler.Start(name)
+
+
+def finish_profile():
+    """
+    :rtype: profile record of the current complex, or None
+    """
+    if _profiler is None:
+        return None
+    return _profiler.Finish()
+
+
+def profile_stage(name):
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.Stage(name)
+
+
+def profile_count(**counts):
+    if _profiler is not None:
+        _profiler.Count(**counts)
+
+
+def percentile(values, q):
+    """
+    Nearest-rank percentile of sorted values.
+    """
+    rank = max(0, int(math.ceil(q / 100.0 * len(values))) - 1)
+    return values[rank]
+
+
+def summarize_profiles(records):
+    """
+    :rtype: dict (stage -> statistics, "counts" -> count -> statistics)
+    """
+    stages = {}
+    counts = {}
+    for record in records:
+        for name, stage in record["stages"].items():
+            stages.setdefault(name, []).append(stage)
+        for name, value in record["counts"].items():
+            counts.setdefault(name, []).append(value)
+
+    summary = {"complexes": len(records), "stages": {}, "counts": {}}
+    for name, values in stages.items():
+        stats = {"n": len(values),
+                 "total_wall": sum(v["wall"] for v in values),
+                 "total_cpu": sum(v["cpu"] for v in values),
+                 "maxrss_kb": max(v["maxrss_kb"] for v in values)}
+        for key in ("wall", "cpu"):
+            ordered = sorted(v[key] for v in values)
+            for q in PROFILE_PERCENTILES:
+                stats["%s_p%d" % (key, q)] = percentile(ordered, q)
+        summary["stages"][name] = stats
+    for name, values in counts.items():
+        ordered = sorted(values)
+        summary["counts"][name] = dict(("p%d" % q, percentile(ordered, q)) for q in PROFILE_PERCENTILES)
+        summary["counts"][name]["max"] = ordered[-1]
+    return summary
+
+
+def report_profiles(args, records):
+    """
+    Prints the summary of the profile records to stderr and writes them into
+    the --profile-json sidecar.
+    """
+    records = [record for record in records if record is not None]
+    if not records:
+        return
+    summary = summarize_profiles(records)
+
+    out = sys.stderr
+    print("Profile of %d complex(es)" % summary["complexes"], file=out)
+    print("%-10s %6s %10s %10s %10s %10s %10s %12s" % ("stage", "n", "wall", "wall p50", "wall p90",
+                                                        "wall p99", "cpu", "maxrss (kB)"), file=out)
+    for name, stats in sorted(summary["stages"].items(), key=lambda item: -item[1]["total_wall"]):
+        print("%-10s %6d %10.4f %10.4f %10.4f %10.4f %10.4f %12d" % (
+            name, stats["n"], stats["total_wall"], stats["wall_p50"], stats["wall_p90"],
+            stats["wall_p99"], stats["total_cpu"], stats["maxrss_kb"]), file=out)
+    for name, stats in sorted(summary["counts"].items()):
+        print("%-14s p50=%s p90=%s p99=%s max=%s" % (name, stats["p50"], stats["p90"], stats["p99"], stats["max"]), file=out)
+
+    if getattr(args, "profile_json", None):
+        with open(args.profile_json, "w") as f:
+            json.dump({"summary": summary, "records": records}, f, indent=1)
@@ -0,0 +1,199 @@
+#############################################################################
+# Compact in-memory tables of interaction records
+#############################################################################
+import array
+import sys
+from openeye import oechem
+from .extraction import (LIST_TYPE_CONTACTS, collect_interaction_hints, index_protein_interactions,
+                         iter_indexed_records)
+from .profiling import profile_stage, profile_count
+
+class StringTable(object):
+    """
+    Interns strings into dense integer codes.
+    """
+
+    def __init__(self):
+        self.codes = {}
+        self.strings = []
+
+    def Code(self, string):
+        code = self.codes.get(string)
+        if code is None:
+            code = self.codes[string] = len(self.strings)
+            self.strings.append(string)
+        return code
+
+    def __len__(self):
+        return len(self.strings)
+
+
+RECORD_TABLES = ["resname", "chain", "protatom", "contact", "subsite", "ligatom"]
+
+def make_record_tables():
+    """
+    :rtype: dict (name of RECORD_TABLES -> StringTable), to be shared by the
+            InteractionTables of many complexes
+    """
+    tables = dict((name, StringTable()) for name in RECORD_TABLES)
+    for ContactType in LIST_TYPE_CONTACTS:
+        tables["contact"].Code(ContactType)
+    return tables
+
+
+class InteractionTable(object):
+    """
+    Interaction records stored as integer columns instead of one dict per
+    row. Residue names, chain IDs, protein atom names, contact types,
+    subsites and ligand atom names are codes into interned StringTables,
+    which InteractionTables built with the same tables share. The ligand
+    atoms of row i are the codes ligatoms[ligatoms_offsets[i]:ligatoms_offsets[i + 1]].
+    Rows are only formatted as dicts with the keys of the output FIELDS when
+    iterated or indexed.
+    """
+    __slots__ = ("tables", "resname", "resid", "chain", "protatom", "contact", "subsite",
+                 "ligatoms", "ligatoms_offsets")
+
+    def __init__(self, tables=None):
+        self.tables = tables if tables is not None else make_record_tables()
+        self.resname = array.array("i")
+        self.resid = array.array("i")
+        self.chain = array.array("i")
+        self.protatom = array.array("i")
+        self.contact = array.array("b")
+        self.subsite = array.array("i")
+        self.ligatoms = array.array("i")
+        self.ligatoms_offsets = array.array("q", [0])
+
+    def Append(self, resname, resid, chain, protatom, ContactType, subsite, ligatoms):
+        """
+        :param subsite: name or None
+        :param ligatoms: codes of the ligand atom names in tables["ligatom"]
+        """
+        tables = self.tables
+        self.resname.append(tables["resname"].Code(resname))
+        self.resid.append(resid)
+        self.chain.append(tables["chain"].Code(chain))
+        self.protatom.append(tables["protatom"].Code(protatom))
+        self.contact.append(tables["contact"].Code(ContactType))
+        self.subsite.append(-1 if subsite is None else tables["subsite"].Code(subsite))
+        self.ligatoms.extend(ligatoms)
+        self.ligatoms_offsets.append(len(self.ligatoms))
+
+    def AppendInteraction(self, interaction):
+        """
+        :type interaction: dict with the keys of the output FIELDS
+        """
+        ligatom = self.tables["ligatom"]
+        self.Append(interaction["ResName_Prot"], interaction["ResID_Prot"], interaction["ChainID_Prot"],
+                    interaction["AtomName_Prot"], interaction["ContactType"], interaction["Subsite"],
+                    [ligatom.Code(latom) for latom in interaction["AtomsName_Lig"]])
+
+    def Extend(self, other):
+        """
+        Appends the rows of other, recoding them into the tables of self
+        when other was built with other tables.
+
+        :type other: InteractionTable
+        """
+        def recode(column, name):
+            if other.tables is self.tables:
+                return column
+            table = self.tables[name]
+            codes = [table.Code(string) for string in other.tables[name].strings]
+            return [codes[code] if code >= 0 else -1 for code in column]
+
+        offset = self.ligatoms_offsets[-1]
+        self.resname.extend(recode(other.resname, "resname"))
+        self.resid.extend(other.resid)
+        self.chain.extend(recode(other.chain, "chain"))
+        self.protatom.extend(recode(other.protatom, "protatom"))
+        self.contact.extend(recode(other.contact, "contact"))
+        self.subsite.extend(recode(other.subsite, "subsite"))
+        self.ligatoms.extend(recode(other.ligatoms, "ligatom"))
+        self.ligatoms_offsets.extend(offset + end for end in other.ligatoms_offsets[1:])
+
+    def GetRow(self, i):
+        """
+        :rtype: dict with the keys of the output FIELDS
+        """
+        strings = dict((name, table.strings) for name, table in self.tables.items())
+        return self.FormatRow(i, strings)
+
+    def FormatRow(self, i, strings):
+        subsite = self.subsite[i]
+        ligatom = strings["ligatom"]
+        return {"ResName_Prot": strings["resname"][self.resname[i]], "ResID_Prot": self.resid[i],
+                "ChainID_Prot": strings["chain"][self.chain[i]], "AtomName_Prot": strings["protatom"][self.protatom[i]],
+                "AtomsName_Lig": [ligatom[code] for code in
+                                  self.ligatoms[self.ligatoms_offsets[i]:self.ligatoms_offsets[i + 1]]],
+                "ContactType": strings["contact"][self.contact[i]],
+                "Subsite": strings["subsite"][subsite] if subsite >= 0 else None}
+
+    def __len__(self):
+        return len(self.resid)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("row index out of range")
+        return self.GetRow(i)
+
+    def __iter__(self):
+        strings = dict((name, table.strings) for name, table in self.tables.items())
+        for i in range(len(self)):
+            yield self.FormatRow(i, strings)
+
+    def GetSize(self):
+        """
+        :rtype: int (bytes held by the columns, the shared tables excluded)
+        """
+        return sys.getsizeof(self) + sum(sys.getsizeof(getattr(self, name)) for name in self.__slots__[1:])
+
+
+def make_table(interactions, tables=None):
+    """
+    :type interactions: iterator of dicts with the keys of the output FIELDS
+    :param tables: string tables shared with other InteractionTables, see make_record_tables
+    :rtype: InteractionTable
+    """
+    table = InteractionTable(tables)
+    for interaction in interactions:
+        table.AppendInteraction(interaction)
+    return table
+
+
+def get_ligand_atom_codes(asite, ligatom):
+    """
+    Interns the name of every ligand atom once.
+
+    :type ligatom: StringTable
+    :rtype: dict (ligand atom index -> code)
+    """
+    ligand = asite.GetMolecule(oechem.OELigandInteractionHintComponent())
+    return dict((latom.GetIdx(), ligatom.Code(str(latom).strip().replace(" ",""))) for latom in ligand.GetAtoms())
+
+
+def extract_table(asite, subsites=None, list_type_contacts=LIST_TYPE_CONTACTS, tables=None):
+    """
+    Compact counterpart of extract: the same rows, built straight into an
+    InteractionTable without intermediate dicts.
+
+    :type asite: oechem.OEInteractionHintContainer
+    :type subsites: SubsiteMap or None
+    :param tables: string tables shared with other InteractionTables, see make_record_tables
+    :rtype: InteractionTable
+    """
+    table = InteractionTable(tables)
+    with profile_stage("extract"):
+        hints = collect_interaction_hints(asite, list_type_contacts)
+        index = index_protein_interactions(hints)
+        ligatomcodes = get_ligand_atom_codes(asite, table.tables["ligatom"])
+        for residue, atom, ligatoms, ContactType in iter_indexed_records(index, list_type_contacts):
+            resid, chain = residue.GetResidueNumber(), residue.GetChainID()
+            subsite = subsites.GetSubsite(resid, chain) if subsites is not None else None
+            table.Append(residue.GetName(), resid, chain, atom.GetName(), ContactType, subsite,
+                         [ligatomcodes[idx] for idx in ligatoms])
+    profile_count(inter_hints=len(hints))
+    return table
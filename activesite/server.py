@@ -0,0 +1,424 @@
+#############################################################################
+# Local interaction service on a pool of warm worker processes
+#
+# Requests and responses are newline-delimited JSON objects exchanged over
+# a TCP ("host:port") or Unix socket (path):
+#
+#   {"id": 1, "path": "complex.pdb", "params": {"hbond": 3.0, "subsites": 0}}
+#   {"id": 2, "data": "<PDB text>", "format": "pdb"}
+#   {"id": 3, "data": "<base64 OEB>", "format": "oeb", "encoding": "base64", "map": "complex.svg"}
+#
+#   {"id": 1, "interactions": [{"ResName_Prot": "ASP", ...}, ...], "elapsed": 0.12}
+#   {"id": 2, "error": "Cannot separate complex!"}
+#
+# The interactions are the rows written by get_protein_interactions. The
+# responses of a connection are sent as they complete, possibly out of
+# order, and are matched to their request by id.
+#
+# Maps are only written, under their relative file name, into the
+# --serve-map-dir directory of the server. The server only listens on
+# loopback addresses.
+#############################################################################
+import sys
+import argparse
+import asyncio
+import base64
+import ipaddress
+import json
+import os
+import time
+from concurrent import futures
+from openeye import oechem
+from .options import PERCEPTION_PARAMS
+from .extraction import LIST_TYPE_CONTACTS, iter_protein_interactions
+from .subsites import get_subsite_map
+from .perception import SPLIT_SETUP
+from .batch import perceive_complex, get_complex_setup, get_error_message
+from .cache import extract_interactions
+
+# request parameters overriding the server defaults
+REQUEST_PARAMS = PERCEPTION_PARAMS + ["subsites", "subsite_map", "prefilter", "prefilter_margin"]
+
+SERVER_LINE_LIMIT = 1 << 28
+
+def add_server_arguments(argParser):
+    argParser.add_argument("--serve", help="Serve interaction requests on this local address, host:port or Unix socket path, with --jobs warm workers", metavar="ADDRESS")
+    argParser.add_argument("--serve-batch", help="Maximum number of requests sent to a worker at once, requests being first spread over the --jobs workers (default=8)", dest="serve_batch", type=int, default=8)
+    argParser.add_argument("--serve-wait", help="Milliseconds to wait for more requests before sending a partial batch (default=2)", dest="serve_wait", type=float, default=2.0)
+    argParser.add_argument("--serve-pending", help="Maximum number of requests in progress, further requests wait to be read (default=256)", dest="serve_pending", type=int, default=256)
+    argParser.add_argument("--serve-map-dir", help="Directory the active site maps requested with \"map\" are written into, maps are refused without it", dest="serve_map_dir")
+
+
+def parse_address(address):
+    """
+    :rtype: tuple (host, port) or Unix socket path
+    """
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return host or "127.0.0.1", int(port)
+    return address
+
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def get_map_path(mapdir, name):
+    """
+    :rtype: str (path of the map name within mapdir)
+    :raises ValueError: when maps are disabled or name leads outside of mapdir
+    """
+    if not mapdir:
+        raise ValueError("Maps are disabled, start the server with --serve-map-dir")
+    root = os.path.realpath(mapdir)
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.isabs(name) or os.path.dirname(path) != root:
+        raise ValueError("Invalid map name %s" % name)
+    return path
+
+
+#############################################################################
+# WORKERS
+#############################################################################
+
+# server defaults of the worker process, see init_server_worker
+_defaults = None
+
+def init_server_worker(args):
+    """
+    Loads the toolkit and checks its license once per worker process.
+    """
+    global _defaults
+    _defaults = args
+    if not oechem.OEChemIsLicensed():
+        oechem.OEThrow.Warning("OEChem is not licensed!")
+
+
+def warm_up():
+    return True
+
+
+def get_request_args(defaults, params):
+    """
+    :rtype: argparse.Namespace of the defaults overridden by params
+    """
+    args = argparse.Namespace(**vars(defaults))
+    for name, value in params.items():
+        if name not in REQUEST_PARAMS:
+            raise ValueError("Unknown parameter %s" % name)
+        setattr(args, name, get_request_value(name, getattr(defaults, name), value))
+    return args
+
+
+def get_request_value(name, default, value):
+    """
+    Checks a JSON parameter value against the type of its server default,
+    without the conversions that would turn "false" into True.
+
+    :raises ValueError: when value does not have the type of the parameter
+    """
+    if name == "subsites":
+        if value not in (0, 1) or isinstance(value, float):
+            raise ValueError("Invalid parameter %s, expected 0, 1 or a boolean" % name)
+        return int(value)
+    if isinstance(default, bool):
+        if not isinstance(value, bool):
+            raise ValueError("Invalid parameter %s, expected a boolean" % name)
+        return value
+    if isinstance(default, float):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError("Invalid parameter %s, expected a number" % name)
+        return float(value)
+    if not isinstance(value, type(default)):
+        raise ValueError("Invalid parameter %s, expected a %s" % (name, type(default).__name__))
+    return value
+
+
+def get_request_data(request):
+    """
+    :rtype: tuple (path or None, bytes or None, format extension)
+    """
+    fmt = "." + request.get("format", "pdb").lstrip(".")
+    if "path" in request:
+        return request["path"], None, fmt
+    if "data" not in request:
+        raise ValueError("Either path or data is required")
+    if request.get("encoding") == "base64":
+        return None, base64.b64decode(request["data"]), fmt
+    return None, request["data"].encode("utf-8"), fmt
+
+
+def serve_request(request):
+    """
+    :rtype: dict (response to the request)
+    """
+    start = time.perf_counter()
+    response = {"id": request.get("id")}
+    try:
+        args = get_request_args(_defaults, request.get("params", {}))
+        path, data, fmt = get_request_data(request)
+        source = path if data is None else data
+        if request.get("map"):
+            from .depiction import MAP_SPLIT_SETUP, get_image_size, write_activesite_map
+            mappath = get_map_path(args.serve_map_dir, request["map"])
+            asite, error = perceive_complex(path or "request", data, args, MAP_SPLIT_SETUP, fmt)
+            if asite is not None:
+                width, height = get_image_size()
+                write_activesite_map(mappath, asite, width, height)
+                interactions = list(iter_protein_interactions(asite, LIST_TYPE_CONTACTS, get_subsite_map(args)))
+        else:
+            setup = "%s format=%s" % (get_complex_setup(args), fmt)
+            interactions, error = extract_interactions(args, setup, [source], perceive_complex,
+                                                       path or "request", data, args, SPLIT_SETUP, fmt)
+    except Exception as err:
+        error = get_error_message(err)
+    if error is not None:
+        response["error"] = error
+    else:
+        response["interactions"] = list(interactions)
+    response["elapsed"] = time.perf_counter() - start
+    return response
+
+
+def serve_batch(requests):
+    return [serve_request(request) for request in requests]
+
+
+#############################################################################
+# SERVER
+#############################################################################
+
+class InteractionServer(object):
+    """
+    Reads requests from the connections, gathers those arriving within
+    args.serve_wait ms and spreads them over the pool of args.jobs warm
+    workers, in batches of up to args.serve_batch requests but never more
+    than needed to give every worker a batch. At most
+    args.serve_pending requests are in progress; connections are not read
+    further until some complete.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.pool = None
+        self.generation = 0
+        self.ready = asyncio.Event()
+        self.queue = asyncio.Queue()
+        self.pending = asyncio.Semaphore(max(1, args.serve_pending))
+
+    def StartPool(self):
+        self.pool = futures.ProcessPoolExecutor(max_workers=max(1, self.args.jobs),
+                                                initializer=init_server_worker, initargs=(self.args,))
+        for future in [self.pool.submit(warm_up) for _ in range(max(1, self.args.jobs))]:
+            future.result()
+
+    def Close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def RestartPool(self):
+        self.Close()
+        self.StartPool()
+
+    async def Restart(self, generation):
+        """
+        Replaces the pool of the given generation once, however many batches
+        saw it break, without blocking the event loop.
+        """
+        if generation != self.generation:
+            return
+        self.generation += 1
+        self.ready.clear()
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, self.RestartPool)
+        finally:
+            self.ready.set()
+
+    async def Handle(self, reader, writer):
+        lock = asyncio.Lock()
+        tasks = set()
+        while True:
+            await self.pending.acquire()
+            try:
+                line = await reader.readline()
+            except (ConnectionError, ValueError):
+                line = b""
+            if not line:
+                self.pending.release()
+                break
+            task = asyncio.ensure_future(self.Respond(line, writer, lock))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+        writer.close()
+
+    async def Respond(self, line, writer, lock):
+        try:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("not a JSON object")
+            except ValueError as err:
+                response = {"id": None, "error": "Invalid request: %s" % err}
+            else:
+                future = asyncio.get_event_loop().create_future()
+                await self.queue.put((request, future))
+                response = await future
+            async with lock:
+                writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.pending.release()
+
+    async def Dispatch(self):
+        loop = asyncio.get_event_loop()
+        jobs = max(1, self.args.jobs)
+        maxbatch = max(1, self.args.serve_batch)
+        while True:
+            gathered = [await self.queue.get()]
+            deadline = loop.time() + self.args.serve_wait / 1000.0
+            while len(gathered) < jobs * maxbatch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    gathered.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # a batch runs in a single worker, larger batches than
+            # ceil(gathered / jobs) would leave warm workers idle
+            size = min(maxbatch, -(-len(gathered) // jobs))
+            for start in range(0, len(gathered), size):
+                asyncio.ensure_future(self.RunBatch(gathered[start:start + size]))
+
+    async def RunBatch(self, batch):
+        loop = asyncio.get_event_loop()
+        requests = [request for request, future in batch]
+        await self.ready.wait()
+        generation = self.generation
+        try:
+            responses = await loop.run_in_executor(self.pool, serve_batch, requests)
+        except futures.process.BrokenProcessPool:
+            # a worker exited (e.g. a fatal toolkit error), answer the batch and start afresh
+            await self.Restart(generation)
+            responses = [{"id": request.get("id"), "error": "Worker process exited"} for request in requests]
+        for (request, future), response in zip(batch, responses):
+            if not future.cancelled():
+                future.set_result(response)
+
+
+async def serve(args):
+    address = parse_address(args.serve)
+    if isinstance(address, tuple) and not is_loopback(address[0]):
+        raise ValueError("The server only listens on loopback addresses, not %s" % address[0])
+    server = InteractionServer(args)
+    server.StartPool()
+    server.ready.set()
+    dispatcher = asyncio.ensure_future(server.Dispatch())
+    try:
+        if isinstance(address, tuple):
+            listener = await asyncio.start_server(server.Handle, address[0], address[1], limit=SERVER_LINE_LIMIT)
+        else:
+            listener = await asyncio.start_unix_server(server.Handle, address, limit=SERVER_LINE_LIMIT)
+        print("Serving on %s with %d worker(s)" % (args.serve, max(1, args.jobs)), file=sys.stderr)
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        dispatcher.cancel()
+        server.Close()
+
+
+def run_server(args):
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+#############################################################################
+# CLIENT
+#############################################################################
+
+class InteractionClient(object):
+    """
+    Asynchronous client multiplexing requests over one connection:
+
+        client = InteractionClient("127.0.0.1:8765")
+        await client.Connect()
+        response = await client.Request(path="complex.pdb", params={"hbond": 3.0})
+        await client.Close()
+    """
+
+    def __init__(self, address):
+        self.address = parse_address(address)
+        self.reader = None
+        self.writer = None
+        self.receiver = None
+        self.responses = {}
+        self.nextid = 0
+
+    async def Connect(self):
+        if isinstance(self.address, tuple):
+            self.reader, self.writer = await asyncio.open_connection(self.address[0], self.address[1], limit=SERVER_LINE_LIMIT)
+        else:
+            self.reader, self.writer = await asyncio.open_unix_connection(self.address, limit=SERVER_LINE_LIMIT)
+        self.receiver = asyncio.ensure_future(self.Receive())
+
+    async def Receive(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self.responses.pop(response.get("id"), None)
+                if future is not None and not future.cancelled():
+                    future.set_result(response)
+        finally:
+            for future in self.responses.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Connection closed by the server"))
+            self.responses.clear()
+
+    async def Request(self, **request):
+        """
+        :rtype: dict (response of the server)
+        """
+        self.nextid += 1
+        request["id"] = self.nextid
+        future = asyncio.get_event_loop().create_future()
+        self.responses[self.nextid] = future
+        self.writer.write(json.dumps(request).encode("utf-8") + b"\n")
+        await self.writer.drain()
+        return await future
+
+    async def Close(self):
+        self.writer.close()
+        if self.receiver is not None:
+            await asyncio.gather(self.receiver, return_exceptions=True)
+
+
+def request_interactions(address, **request):
+    """
+    Sends one request and waits for its response.
+
+    :rtype: dict
+    """
+    async def send():
+        client = InteractionClient(address)
+        await client.Connect()
+        try:
+            return await client.Request(**request)
+        finally:
+            await client.Close()
+    return asyncio.run(send())
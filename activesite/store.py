@@ -0,0 +1,256 @@
+#############################################################################
+# Store of prepared structures: proteins and ligands already split from
+# their complex, with perceived residues
+#############################################################################
+import json
+import mmap
+import os
+import time
+from openeye import oechem
+from .cache import hash_input
+from .perception import read_receptor
+from .profiling import profile_stage
+
+STORE_INDEX = "index.jsonl"
+STORE_DATA = "structures.bin"
+
+# setup of the receptors prepared alone, see read_prepared_receptor
+RECEPTOR_SETUP = "receptor"
+
+def add_store_arguments(argParser):
+    argParser.add_argument("--store", help="Prepared-structure store written by activesiteinteractions.py --prepare, the complex and receptor files and the molecules of multi-molecule --batch files found in it are not parsed and split again (use --batch STORE to run every complex of the store)")
+
+
+class StructureStore(object):
+    """
+    Directory of prepared structures:
+
+    - structures.bin: the OEB bytes (as written by OEWriteMolToBytes) of the
+      prepared molecules, one after the other, memory-mapped for reading
+    - index.jsonl: one JSON object per entry, appended as entries are added,
+      {"name": ..., "input": path, "hash": see get_entry_hash, "setup": split setup,
+       "protein": [offset, length], "ligand": [offset, length] or null, "time": ...}
+
+    Entries are looked up by input hash and split setup. The last entry of
+    an input wins.
+    """
+
+    def __init__(self, path, write=False):
+        self.path = path
+        self.entries = {}
+        self.fdata = None
+        self.findex = None
+        self.map = None
+        self.fmap = None
+        if write and not os.path.isdir(path):
+            os.makedirs(path)
+        indexname = os.path.join(path, STORE_INDEX)
+        if not write and not os.path.exists(indexname):
+            raise IOError("No prepared-structure store in %s" % path)
+        if os.path.exists(indexname):
+            self.ReadIndex(indexname)
+        if write:
+            self.fdata = open(os.path.join(path, STORE_DATA), "ab")
+            self.findex = open(indexname, "a")
+
+    def ReadIndex(self, indexname):
+        with open(indexname) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # line truncated by a killed run
+                    continue
+                self.entries[(entry["hash"], entry["setup"])] = entry
+
+    def Lookup(self, inputhash, setup):
+        """
+        :rtype: dict (index entry) or None
+        """
+        return self.entries.get((inputhash, setup))
+
+    def Add(self, name, inputpath, inputhash, setup, protein, ligand=None):
+        """
+        :param protein: OEB bytes of the protein
+        :param ligand: OEB bytes of the ligand, None for a receptor alone
+        :rtype: dict (index entry)
+        """
+        entry = {"name": name, "input": inputpath, "hash": inputhash, "setup": setup,
+                 "protein": self.Append(protein), "ligand": self.Append(ligand) if ligand is not None else None,
+                 "time": time.time()}
+        self.fdata.flush()
+        self.findex.write(json.dumps(entry))
+        self.findex.write("\n")
+        self.findex.flush()
+        self.entries[(inputhash, setup)] = entry
+        return entry
+
+    def Append(self, data):
+        self.fdata.seek(0, os.SEEK_END)
+        offset = self.fdata.tell()
+        self.fdata.write(data)
+        return [offset, len(data)]
+
+    def Read(self, entry):
+        """
+        :rtype: tuple (protein, ligand or None) of oechem.OEGraphMol
+        """
+        protein = self.ReadMol(entry["protein"])
+        ligand = self.ReadMol(entry["ligand"]) if entry["ligand"] is not None else None
+        return protein, ligand
+
+    def ReadMol(self, span):
+        offset, length = span
+        if self.map is None or offset + length > len(self.map):
+            self.Map()
+        mol = oechem.OEGraphMol()
+        if not oechem.OEReadMolFromBytes(mol, ".oeb", self.map[offset:offset + length]):
+            raise IOError("Unable to read molecule at %d from %s" % (offset, self.path))
+        return mol
+
+    def Map(self):
+        self.Unmap()
+        if self.fdata is not None:
+            self.fdata.flush()
+        self.fmap = open(os.path.join(self.path, STORE_DATA), "rb")
+        self.map = mmap.mmap(self.fmap.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def Unmap(self):
+        if self.map is not None:
+            self.map.close()
+            self.fmap.close()
+        self.map = self.fmap = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        """
+        Yields the index entries, in the order they were added.
+        """
+        return iter(sorted(self.entries.values(), key=lambda entry: entry["protein"][0]))
+
+    def Close(self):
+        self.Unmap()
+        for f in (self.fdata, self.findex):
+            if f is not None:
+                f.close()
+        self.fdata = self.findex = None
+
+
+def is_store(path):
+    return os.path.isfile(os.path.join(path, STORE_INDEX))
+
+
+def get_entry_hash(path, n=None):
+    """
+    :param n: position of the molecule (from 1) in a multi-molecule file
+    :rtype: str (hash of the raw bytes of the input file, and of the position)
+    """
+    if n is None:
+        return hash_input(path)
+    return "%s:%d" % (hash_input(path), n)
+
+
+def iter_store_inputs(path):
+    """
+    Yields one (name, store path, entry hash as bytes) batch item per
+    prepared complex of the store, read back by load_prepared without the
+    original inputs.
+    """
+    seen = set()
+    for entry in open_store(path):
+        if entry["ligand"] is None or entry["hash"] in seen:
+            continue
+        seen.add(entry["hash"])
+        yield entry["name"], path, entry["hash"].encode("ascii")
+
+
+def iter_prepared_inputs(args, items, setup):
+    """
+    Replaces the batch items of a multi-molecule file whose molecules were
+    prepared with setup in the store of args by the items of the store (see
+    iter_store_inputs), found by the hash of the file and their position.
+    Complex files are looked up by the workers, see load_prepared.
+
+    :param items: batch items of iter_batch_inputs
+    """
+    store = get_store(args)
+    if store is None:
+        for item in items:
+            yield item
+        return
+    for n, item in enumerate(items, 1):
+        name, path, data = item
+        if data is not None and not is_store(path):
+            entry = store.Lookup(get_entry_hash(path, n), setup)
+            if entry is not None and entry["ligand"] is not None:
+                item = name, store.path, entry["hash"].encode("ascii")
+        yield item
+
+
+# stores opened by this process, see open_store
+_stores = {}
+
+def open_store(path):
+    """
+    :rtype: StructureStore of path opened once per process
+    :raises IOError: when path is not a store
+    """
+    if path not in _stores:
+        _stores[path] = StructureStore(path)
+    return _stores[path]
+
+
+def get_store(args):
+    """
+    :rtype: StructureStore of args.store, or None
+    """
+    path = getattr(args, "store", None)
+    if not path:
+        return None
+    return open_store(path)
+
+
+def load_prepared(args, path, data, setup):
+    """
+    Reads the complex of a batch item back from a store: the items of
+    iter_store_inputs and iter_prepared_inputs, or the complex files (data
+    None) found in the store of args by the hash of their bytes.
+
+    :rtype: tuple (protein, ligand) prepared with setup, or None when not in
+            the store
+    :raises IOError: when a store item was not prepared with setup
+    """
+    if data is not None:
+        if not is_store(path):
+            return None
+        entry = open_store(path).Lookup(data.decode("ascii"), setup)
+        if entry is None:
+            raise IOError("Not prepared with the '%s' split setup in %s" % (setup, path))
+        store = open_store(path)
+    else:
+        store = get_store(args)
+        if store is None:
+            return None
+        entry = store.Lookup(get_entry_hash(path), setup)
+        if entry is None or entry["ligand"] is None:
+            return None
+    with profile_stage("store"):
+        return store.Read(entry)
+
+
+def read_prepared_receptor(args):
+    """
+    Reads args.pname from the store of args when prepared there, or else
+    from the file.
+
+    :rtype: oechem.OEGraphMol
+    """
+    store = get_store(args)
+    if store is not None:
+        entry = store.Lookup(get_entry_hash(args.pname), RECEPTOR_SETUP)
+        if entry is not None:
+            with profile_stage("store"):
+                return store.Read(entry)[0]
+    return read_receptor(args.pname)
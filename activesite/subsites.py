@@ -0,0 +1,90 @@
+#############################################################################
+# Interaction subsite maps
+#############################################################################
+import json
+
+BACE_SUBSITES = {"SS01":[30,71,108,115,118], "SS02":[32,228], "SS03":[72,73,107], "SS04":[230,231], "SS05":[34,198], "SS06":[110], "SS07":[232,233,235,325], "SS08":[35,69,70,76,126,128], "SS09":[11,13,14,229,335], "SS10":[224,226,329,332]}
+
+# BACE2 residue numbers mapped onto the BACE numbering of BACE_SUBSITES
+BACE2_RENUMBER = [{"below": 165, "offset": 16}, {"below": 318, "offset": 13}, {"offset": 12}]
+
+BUILTIN_SUBSITE_MAPS = {
+    "bace": {"subsites": BACE_SUBSITES},
+    "bace2": {"subsites": BACE_SUBSITES, "renumber": BACE2_RENUMBER},
+}
+
+
+class SubsiteMap(object):
+    """
+    Residue to subsite index built once from a subsite definition:
+
+    {"subsites": {"SS01": [30, "B:71", ...], ...},
+     "renumber": [{"chain": "A", "below": 165, "offset": 16}, {"offset": 12}, ...]}
+
+    Residues are given by number, optionally prefixed by a chain ID. The
+    optional renumber table shifts input residue numbers before the lookup:
+    the first entry whose chain (if any) matches and whose residue number is
+    below "below" (if any) applies.
+    """
+
+    def __init__(self, definition):
+        self.index = {}
+        for sub, residues in definition["subsites"].items():
+            for res in residues:
+                chain, resid = None, res
+                if isinstance(res, str):
+                    chain, _, resid = res.rpartition(":")
+                    chain = chain or None
+                self.index.setdefault((chain, int(resid)), sub)
+        self.renumber = definition.get("renumber", [])
+        self.cache = {}
+
+    def GetResid(self, resid, chain=None):
+        for entry in self.renumber:
+            if entry.get("chain", chain) != chain:
+                continue
+            if "below" in entry and resid >= entry["below"]:
+                continue
+            return resid + entry["offset"]
+        return resid
+
+    def GetSubsite(self, resid, chain=None):
+        key = (chain, resid)
+        if key not in self.cache:
+            resid = self.GetResid(resid, chain)
+            sub = self.index.get((chain, resid))
+            if sub is None:
+                sub = self.index.get((None, resid))
+            self.cache[key] = sub
+        return self.cache[key]
+
+
+def load_subsite_map(name):
+    """
+    :param name: builtin map name (bace, bace2) or JSON/YAML file
+    :rtype: SubsiteMap
+    :raises ImportError: when name is a YAML file and PyYAML is not installed
+    """
+    if name in BUILTIN_SUBSITE_MAPS:
+        return SubsiteMap(BUILTIN_SUBSITE_MAPS[name])
+    with open(name) as f:
+        if name.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("PyYAML is required to read %s" % name)
+            return SubsiteMap(yaml.safe_load(f))
+        return SubsiteMap(json.load(f))
+
+
+_subsite_maps = {}
+
+def get_subsite_map(args):
+    """
+    :rtype: SubsiteMap or None when subsites are disabled
+    """
+    if args.subsites != 1:
+        return None
+    if args.subsite_map not in _subsite_maps:
+        _subsite_maps[args.subsite_map] = load_subsite_map(args.subsite_map)
+    return _subsite_maps[args.subsite_map]
@@ -0,0 +1,189 @@
+#############################################################################
+# Parameter sweep deriving tighter cutoffs by filtering the hints perceived
+# at the loosest ones
+#############################################################################
+import argparse
+import itertools
+import math
+import os
+from openeye import oechem
+from .extraction import (LIST_TYPE_CONTACTS, collect_interaction_hints, index_protein_interactions, iter_indexed_interactions,
+                         get_ligand_atom_names, iter_protein_interactions)
+from .subsites import get_subsite_map
+from .output import write_interactions
+from .batch import perceive_complex, get_batch_output_names
+
+# cutoffs that are upper bounds of a geometric measure of the hints they
+# govern, so that tighter values can be derived by filtering (clashcontact
+# is a lower bound turning contacts into clashes and cannot be swept)
+SWEEP_PARAMS = ["hbond", "hbondni", "hbondca", "halogenbond", "pistack", "tstack", "saltbridge", "cationpi", "contact"]
+
+SWEEP_TOLERANCE = 1.0e-4
+
+def parse_sweep(specs):
+    """
+    :param specs: list of "param=v1,v2,..." strings
+    :rtype: list of (param, sorted list of values)
+    :raises ValueError: on an unknown parameter or invalid values
+    """
+    grid = []
+    for spec in specs:
+        param, _, values = spec.partition("=")
+        param = param.strip().lstrip("-")
+        if param not in SWEEP_PARAMS:
+            raise ValueError("Cannot sweep %s, choose from %s" % (param, ", ".join(SWEEP_PARAMS)))
+        try:
+            values = sorted(set(float(v) for v in values.split(",") if v.strip()))
+        except ValueError:
+            raise ValueError("Invalid sweep values in %s" % spec)
+        if not values:
+            raise ValueError("No sweep values in %s" % spec)
+        grid.append((param, values))
+    return grid
+
+
+# hint type predicates and the cutoff governing the hints they match, the
+# more specific types first (a charge-aided hydrogen bond is a hydrogen bond)
+HINT_PARAMS = [
+    (oechem.OEIsChargeAidedHBondInteractionHint(), "hbondca"),
+    (oechem.OEIsNonIdealHBondInteractionHint(), "hbondni"),
+    (oechem.OEIsHBondInteractionHint(), "hbond"),
+    (oechem.OEIsHalogenBondInteractionHint(), "halogenbond"),
+    (oechem.OEIsTStackingInteractionHint(), "tstack"),
+    (oechem.OEIsStackingInteractionHint(), "pistack"),
+    (oechem.OEIsSaltBridgeInteractionHint(), "saltbridge"),
+    (oechem.OEIsCationPiInteractionHint(), "cationpi"),
+    (oechem.OEIsContactInteractionHint(), "contact"),
+]
+
+def get_hint_param(inter):
+    """
+    :rtype: name of the cutoff governing the hint, or None
+    """
+    for pred, param in HINT_PARAMS:
+        if pred(inter):
+            return param
+    return None
+
+
+def is_hint_kept(param, measure, cutoffs):
+    """
+    :param cutoffs: dict (param -> cutoff) of the combination
+    :rtype: bool (True when the hint is still perceived with cutoffs)
+    """
+    if measure is None or measure <= cutoffs[param] + SWEEP_TOLERANCE:
+        return True
+    # an ideal hydrogen bond beyond the hbond cutoff is perceived as a
+    # non-ideal one within the hbondni cutoff, still an hbond row
+    return param == "hbond" and measure <= cutoffs["hbondni"] + SWEEP_TOLERANCE
+
+
+def get_centroid(mol, atoms):
+    coords = [mol.GetCoords(atom) for atom in atoms]
+    return [sum(xyz[i] for xyz in coords) / len(coords) for i in range(3)]
+
+
+def measure_hint(param, protein, protatoms, ligand, ligatoms):
+    """
+    Geometric measure compared against the param cutoff: ring centroid
+    distance for stacking and cation-pi, closest distance over the sum of
+    the van der Waals radii for contacts, closest atom distance otherwise.
+    """
+    if param in ("pistack", "tstack", "cationpi"):
+        pc, lc = get_centroid(protein, protatoms), get_centroid(ligand, ligatoms)
+        return math.sqrt(sum((pc[i] - lc[i]) ** 2 for i in range(3)))
+
+    measure = None
+    for patom in protatoms:
+        pxyz = protein.GetCoords(patom)
+        for latom in ligatoms:
+            lxyz = ligand.GetCoords(latom)
+            value = math.sqrt(sum((pxyz[i] - lxyz[i]) ** 2 for i in range(3)))
+            if param == "contact":
+                value /= (oechem.OEGetBondiVdWRadius(patom.GetAtomicNum()) +
+                          oechem.OEGetBondiVdWRadius(latom.GetAtomicNum()))
+            if measure is None or value < measure:
+                measure = value
+    return measure
+
+
+def run_sweep(args, grid):
+    """
+    Perceives args.iname once at the loosest cutoffs of the grid, measures
+    every hint governed by a swept cutoff and writes the interactions of each
+    combination of cutoffs, keeping the hints whose measure is within it.
+
+    Hints may change type at tighter cutoffs (e.g. a stacking falling back
+    to a contact), which filtering cannot reproduce. The tightest combination
+    is therefore also perceived directly; when the rows differ, every
+    combination is perceived directly instead.
+    """
+    if not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+
+    loose = get_sweep_args(args, grid, [values[-1] for param, values in grid])
+    asite, error = perceive_complex(args.iname, None, loose)
+    if asite is None:
+        raise ValueError(error)
+
+    protein = asite.GetMolecule(oechem.OEProteinInteractionHintComponent())
+    ligand = asite.GetMolecule(oechem.OELigandInteractionHintComponent())
+    swept = set(param for param, values in grid)
+
+    measured = []
+    for hint in collect_interaction_hints(asite, LIST_TYPE_CONTACTS):
+        inter, types, protatoms, ligatoms = hint
+        param = get_hint_param(inter)
+        measure = None
+        ligfrag = inter.GetFragment(oechem.OELigandInteractionHintComponent())
+        if param in swept and ligfrag is not None:
+            measure = measure_hint(param, protein, protatoms, ligand, list(ligfrag.GetAtoms()))
+        measured.append((hint, param, measure))
+
+    subsites = get_subsite_map(args)
+    ligatomnames = get_ligand_atom_names(asite)
+
+    def filtered(combination):
+        cutoffs = dict((param, getattr(loose, param)) for param in SWEEP_PARAMS)
+        cutoffs.update((param, value) for (param, values), value in zip(grid, combination))
+        kept = [hint for hint, param, measure in measured if is_hint_kept(param, measure, cutoffs)]
+        return iter_indexed_interactions(index_protein_interactions(kept), LIST_TYPE_CONTACTS, subsites, ligatomnames)
+
+    def direct(combination):
+        asite, error = perceive_complex(args.iname, None, get_sweep_args(args, grid, combination))
+        if asite is None:
+            raise ValueError(error)
+        return iter_protein_interactions(asite, LIST_TYPE_CONTACTS, subsites)
+
+    tightest = [values[0] for param, values in grid]
+    rows = list(direct(tightest))
+    extract = filtered
+    if normalize_rows(filtered(tightest)) != normalize_rows(rows):
+        oechem.OEThrow.Warning("Filtered hints differ from a direct perception at %s, perceiving every combination"
+                               % get_sweep_name(grid, tightest))
+        extract = direct
+
+    for combination in itertools.product(*[values for param, values in grid]):
+        name = get_sweep_name(grid, combination)
+        interactions = rows if list(combination) == tightest else extract(combination)
+        print("%s\t%d" % (name, write_interactions(interactions, *get_batch_output_names(name, args))))
+    return 0
+
+
+def get_sweep_args(args, grid, combination):
+    """
+    :rtype: argparse.Namespace of args with the cutoffs of combination
+    """
+    sweepargs = argparse.Namespace(**vars(args))
+    for (param, values), value in zip(grid, combination):
+        setattr(sweepargs, param, value)
+    return sweepargs
+
+
+def get_sweep_name(grid, combination):
+    return "_".join("%s%g" % (param, value) for (param, values), value in zip(grid, combination))
+
+
+def normalize_rows(interactions):
+    return sorted((row["ContactType"], row["ChainID_Prot"], row["ResID_Prot"], row["AtomName_Prot"],
+                   sorted(row["AtomsName_Lig"])) for row in interactions)
@@ -0,0 +1,227 @@
+#############################################################################
+# Interaction occupancy over the frames of an MD trajectory or of a
+# conformer ensemble
+#############################################################################
+import array
+import csv
+import itertools
+import json
+from openeye import oechem
+from .perception import SPLIT_SETUP, split, perceive_pocket, get_prefilter, PocketSelector
+from .extraction import LIST_TYPE_CONTACTS, iter_protein_interactions, is_water
+from .subsites import get_subsite_map
+from .output import open_output
+from .profiling import start_profile, finish_profile, profile_stage, report_profiles
+
+OCCUPANCY_FIELDS = ["ResName_Prot", "ResID_Prot", "ChainID_Prot", "ContactType", "Subsite", "Frames", "Occupancy"]
+
+def iter_frames(path):
+    """
+    Yields every conformer of every molecule of path, one frame at a time,
+    so that a multi-conformer complex and a stream of single-conformer
+    frames (e.g. a multi-model PDB file) are both read in constant memory.
+
+    :rtype: iterator of oechem.OEConfBase
+    :raises IOError: when path cannot be opened
+    """
+    ifs = oechem.oemolistream()
+    if not ifs.open(path):
+        raise IOError("Unable to open %s for reading" % path)
+    for mol in ifs.GetOEMols():
+        for conf in mol.GetConfs():
+            yield conf
+
+
+class FrameSplit(object):
+    """
+    Protein and ligand split from the first frame, along with the frame atom
+    index of each of their atoms, so that the following frames only update
+    their coordinates instead of perceiving residues and splitting again.
+    Frames must share the atoms of the first frame, in the same order.
+    """
+
+    def __init__(self, frame, setup=SPLIT_SETUP):
+        """
+        :type frame: oechem.OEMolBase
+        """
+        self.protein = None
+        self.ligand = None
+        self.natoms = frame.NumAtoms()
+        self.atomidxs = []
+        self.error = None
+
+        # split atoms are copies, found back in the frame by the map index
+        # they are tagged with, the original map indices being restored
+        frameatoms = [(atom.GetIdx(), atom.GetMapIdx()) for atom in frame.GetAtoms()]
+        complexmol = oechem.OEGraphMol(frame)
+        for tag, atom in enumerate(complexmol.GetAtoms(), 1):
+            atom.SetMapIdx(tag)
+        parts = split(complexmol, setup)
+        if parts is None:
+            self.error = "Cannot separate complex!"
+            return
+
+        for mol in parts:
+            atomidxs = []
+            for atom in mol.GetAtoms():
+                tag = atom.GetMapIdx()
+                if not 0 < tag <= len(frameatoms):
+                    self.error = "Cannot map the split atoms back to the first frame"
+                    return
+                fidx, mapidx = frameatoms[tag - 1]
+                atom.SetMapIdx(mapidx)
+                atomidxs.append((atom.GetIdx(), fidx))
+            self.atomidxs.append(atomidxs)
+        self.protein, self.ligand = parts
+
+    def IsValid(self):
+        return self.protein is not None
+
+    def GetError(self):
+        """
+        :rtype: str (why the first frame could not be split) or None
+        """
+        return self.error
+
+    def Update(self, frame):
+        """
+        Copies the coordinates of frame onto the protein and the ligand.
+
+        :rtype: bool (False when the frame does not match the first one)
+        """
+        if frame.NumAtoms() != self.natoms:
+            return False
+        coords = frame.GetCoords()
+        for mol, atomidxs in zip((self.protein, self.ligand), self.atomidxs):
+            flat = [0.0] * (3 * mol.GetMaxAtomIdx())
+            for idx, fidx in atomidxs:
+                flat[3 * idx:3 * idx + 3] = coords[fidx]
+            mol.SetCoords(oechem.OEFloatArray(flat))
+        return True
+
+
+class OccupancyCounter(object):
+    """
+    Counts the frames in which each protein residue makes each contact type.
+    Residues are those of the protein split from the first frame, so the
+    counts take constant memory whatever the number of frames. Per-frame
+    fingerprints are optionally streamed as newline-delimited JSON: a header
+    with the residue and contact tables, then one line per frame listing its
+    bits residue * ncontact + contact.
+    """
+
+    def __init__(self, protein, subsites, fpname=None):
+        self.subsites = subsites
+        self.residues = []
+        self.rescodes = {}
+        for atom in protein.GetAtoms():
+            res = oechem.OEAtomGetResidue(atom)
+            if is_water(res):
+                continue
+            key = (res.GetName(), res.GetResidueNumber(), res.GetChainID())
+            if key not in self.rescodes:
+                self.rescodes[key] = len(self.residues)
+                self.residues.append(key)
+        self.contacts = dict((ContactType, n) for n, ContactType in enumerate(LIST_TYPE_CONTACTS))
+        self.counts = array.array("l", [0] * (len(self.residues) * len(LIST_TYPE_CONTACTS)))
+        self.frames = 0
+
+        self.ffp = None
+        if fpname:
+            self.ffp = open_output(fpname)
+            self.ffp.write(json.dumps({"residues": self.residues, "contacts": LIST_TYPE_CONTACTS}))
+            self.ffp.write("\n")
+
+    def Add(self, frame, title, interactions):
+        bits = set()
+        for interaction in interactions:
+            key = (interaction["ResName_Prot"], interaction["ResID_Prot"], interaction["ChainID_Prot"])
+            bits.add(self.rescodes[key] * len(LIST_TYPE_CONTACTS) + self.contacts[interaction["ContactType"]])
+        for bit in bits:
+            self.counts[bit] += 1
+        self.frames += 1
+        if self.ffp is not None:
+            self.ffp.write(json.dumps({"frame": frame, "title": title, "bits": sorted(bits)}))
+            self.ffp.write("\n")
+
+    def Close(self):
+        if self.ffp is not None:
+            self.ffp.close()
+            self.ffp = None
+
+    def Write(self, path):
+        """
+        Writes the occupancy of every (residue, contact type) seen in at least
+        one frame, ordered by contact type and then by residue.
+
+        :rtype: int (number of rows written)
+        """
+        count = 0
+        with open_output(path) as f:
+            writer = csv.writer(f, delimiter="\t")
+            writer.writerow(OCCUPANCY_FIELDS)
+            for contact, ContactType in enumerate(LIST_TYPE_CONTACTS):
+                for rescode, (resname, resid, chain) in enumerate(self.residues):
+                    frames = self.counts[rescode * len(LIST_TYPE_CONTACTS) + contact]
+                    if frames == 0:
+                        continue
+                    subsite = self.subsites.GetSubsite(resid, chain) if self.subsites is not None else None
+                    writer.writerow([resname, resid, chain, ContactType, subsite, frames,
+                                     "%.4f" % (float(frames) / self.frames)])
+                    count += 1
+        return count
+
+
+def run_trajectory(args):
+    """
+    Perceives the interactions of every frame of args.trajectory against the
+    protein/ligand split of its first frame and writes the per-residue,
+    per-contact type occupancy into args.occupancy.
+    """
+    frames = iter_frames(args.trajectory)
+    first = next(frames, None)
+    if first is None:
+        raise IOError("Unable to read frame from %s" % args.trajectory)
+
+    start_profile(args, "frame 1")
+    fsplit = FrameSplit(first)
+    if not fsplit.IsValid():
+        raise ValueError(fsplit.GetError())
+
+    occupancy = OccupancyCounter(fsplit.protein, get_subsite_map(args), args.frame_fingerprints)
+    # the residues of the protein are grouped once, only their coordinates
+    # are refreshed per frame
+    radius = get_prefilter(args)
+    selector = PocketSelector(fsplit.protein, radius) if radius > 0 else None
+    profiles = []
+    nskipped = 0
+    for n, frame in enumerate(itertools.chain([first], frames), 1):
+        if n > 1:
+            start_profile(args, "frame %d" % n)
+            if not fsplit.Update(frame):
+                nskipped += 1
+                oechem.OEThrow.Warning("Frame %d does not match the atoms of the first frame, skipped" % n)
+                finish_profile()
+                continue
+        pocket = fsplit.protein
+        if selector is not None:
+            with profile_stage("pocket"):
+                if n > 1:
+                    selector.UpdateCoords()
+                pocket = selector.Crop(fsplit.ligand)
+        try:
+            asite = perceive_pocket(fsplit.protein, pocket, fsplit.ligand, args)
+        except ValueError as err:
+            nskipped += 1
+            oechem.OEThrow.Warning("Frame %d: %s, skipped" % (n, err))
+            finish_profile()
+            continue
+        occupancy.Add(n, frame.GetTitle(), iter_protein_interactions(asite, LIST_TYPE_CONTACTS, occupancy.subsites))
+        record = finish_profile()
+        if record is not None:
+            profiles.append(record)
+    occupancy.Close()
+
+    print("%d frames\t%d" % (occupancy.frames, occupancy.Write(args.occupancy)))
+    report_profiles(args, profiles)
+    return 1 if nskipped else 0
@@ -22,15 +22,26 @@
 import sys
 from openeye import oechem
 import argparse
-import csv
-import json
+from activesite.options import add_perception_arguments
+from activesite.extraction import LIST_TYPE_CONTACTS, iter_protein_interactions, benchmark_protein_interactions
+from activesite.subsites import get_subsite_map
+from activesite.output import write_interactions
+from activesite.batch import (run_batch, process_batch_item, process_ligand_item, get_batch_item_key,
+                              get_ligand_item_key, init_receptor, perceive_complex, get_complex_setup, get_input_stem)
+from activesite.manifest import add_manifest_arguments
+from activesite.store import add_store_arguments, is_store
+from activesite.prepare import add_prepare_arguments, run_prepare
+from activesite.sweep import parse_sweep, run_sweep
+from activesite.comparison import add_diff_arguments, run_diff
+from activesite.trajectory import run_trajectory
+from activesite.server import add_server_arguments, run_server
+from activesite.cache import add_cache_arguments, extract_interactions
+from activesite.profiling import add_profile_arguments, start_profile, finish_profile, report_profiles
+from activesite.columnar import ColumnarWriter
+from activesite.perception import SPLIT_SETUP, add_prefilter_arguments
 
 def main(argv=[__name__]):
 
-    itf = oechem.OEInterface()
-    oechem.OEConfigure(itf, InterfaceData)
-    oechem.OEConfigureSplitMolComplexOptions(itf, oechem.OESplitMolComplexSetup_LigName)
-
     #if not oechem.OEParseCommandLine(itf, argv):
     #    return 0
     
@@ -38,197 +49,96 @@ def main(argv=[__name__]):
 
     argParser = argparse.ArgumentParser()
     argParser.add_argument("--complex", help="PDB Complex", dest="iname")
-    argParser.add_argument("--hbond", help="Maximum Distance of Hydrogen Bond (default=3.2A)", type=float, default=3.2)
-    argParser.add_argument("--hbondni", help="Maximum Distance of Non-Ideal Hydrogen Bond (default=3.7A)", type=float, default=3.8)
-    argParser.add_argument("--hbondca", help="Maximum Distance of Charge-Aided Hydrogen Bond (default=3.5A)", type=float, default=3.5)
-    argParser.add_argument("--halogenbond", help="Maximum Distance of Halogen Bond (default=3.2A)", type=float, default=3.2)
-    argParser.add_argument("--pistack", help="Maximum Distance of Pi-Stacking (default=5.0A)", type=float, default=5.0)
-    argParser.add_argument("--tstack", help="Maximum Distance of T-Stacking (default=5.35A)", type=float, default=5.35)
-    argParser.add_argument("--saltbridge", help="Maximum Distance of Salt Bridge (default=5.0A)", type=float, default=5.0)
-    argParser.add_argument("--cationpi", help="Maximum Distance of Cation-Pi (default=5.5A)", type=float, default=5.5)
-    argParser.add_argument("--contact", help="Maximum Distance of Contacts (default=1.2A)", type=float, default=1.2)
-    argParser.add_argument("--clashcontact", help="Minimum Distance of Contacts (default=0.8A)", type=float, default=0.8)
+    argParser.add_argument("--batch", help="Directory or glob of complex files (one complex per file), or a multi-molecule file (one complex per molecule)", dest="batch")
+    argParser.add_argument("--jobs", help="Number of worker processes in batch mode (default=1)", type=int, default=1)
+    argParser.add_argument("--trajectory", help="MD trajectory or conformer ensemble of a complex (multi-conformer molecule or one molecule per frame), split once on its first frame")
+    argParser.add_argument("--occupancy", help="Output of the per-residue, per-ContactType occupancy of --trajectory, gzip-compressed if it ends with .gz (default=occupancy.tsv)", default="occupancy.tsv")
+    argParser.add_argument("--frame-fingerprints", help="Also stream the per-frame interaction fingerprints of --trajectory into this newline-delimited JSON file", dest="frame_fingerprints")
+    argParser.add_argument("--protein", help="Receptor prepared once and paired with every molecule of --ligands", dest="pname")
+    argParser.add_argument("--ligands", help="Ligand poses (multi-molecule file, directory or glob) perceived against --protein", dest="lname")
+    argParser.add_argument("--pocket", help="Crop the receptor to whole residues within this radius of each ligand, 0 keeps the whole receptor (default=0)", type=float, default=0.0)
+    argParser.add_argument("--outdir", help="Output directory of the per-complex results in batch mode (default=.)", default=".")
+    argParser.add_argument("--tsv", help="TSV output, '' to disable, gzip-compressed if it ends with .gz (default=interactions.tsv)", dest="tsvname", default="interactions.tsv")
+    argParser.add_argument("--jsonl", help="Newline-delimited JSON output, '' to disable, gzip-compressed if it ends with .gz (default=interactions.jsonl)", dest="jsonname", default="interactions.jsonl")
+    argParser.add_argument("--gzip", help="Gzip-compress the per-complex results in batch mode", action="store_true")
+    argParser.add_argument("--columnar", help="Also write the interactions of all complexes as dictionary-encoded NumPy arrays into this directory")
+    argParser.add_argument("--fingerprint", help="Add the residue x ContactType interaction fingerprint of each complex to --columnar", action="store_true")
+    add_perception_arguments(argParser)
+    add_prefilter_arguments(argParser)
     argParser.add_argument("--subsites", help="1 (True) or 0 (False) (default=1)", type=int, choices=[0,1], default=1)
-    args = argParser.parse_args()
-
+    argParser.add_argument("--subsite-map", help="Subsite definition: bace, bace2 or a JSON/YAML file (default=bace)", dest="subsite_map", default="bace")
+    argParser.add_argument("--benchmark", help="Time the single-pass extraction against the per-type scan over N repeats", type=int, default=0, metavar="N")
+    argParser.add_argument("--sweep", help="Perceive --complex once at the largest value of each swept cutoff and write one result table per combination into --outdir (repeatable)", action="append", metavar="PARAM=V1,V2,...")
+    add_diff_arguments(argParser)
+    add_prepare_arguments(argParser)
+    add_store_arguments(argParser)
+    add_manifest_arguments(argParser)
+    add_server_arguments(argParser)
+    add_cache_arguments(argParser)
+    add_profile_arguments(argParser)
+    args = argParser.parse_args(argv[1:])
+
+    try:
+        return run(args)
+    except (IOError, ImportError, ValueError) as err:
+        oechem.OEThrow.Fatal(str(err))
+
+
+def run(args):
+
+    if args.store and not is_store(args.store):
+        oechem.OEThrow.Fatal("No prepared-structure store in %s" % args.store)
+    if args.serve:
+        return run_server(args)
+    if args.prepare:
+        if not (args.iname or args.batch or args.pname):
+            oechem.OEThrow.Fatal("--prepare requires --complex, --batch or --protein")
+        if args.batch and is_store(args.batch):
+            oechem.OEThrow.Fatal("--batch %s is already a prepared-structure store" % args.batch)
+        return run_prepare(args)
+
+    if args.pname or args.lname:
+        if not (args.pname and args.lname):
+            oechem.OEThrow.Fatal("--protein and --ligands must be given together")
+    if args.reference:
+        if not (args.lname or args.batch):
+            oechem.OEThrow.Fatal("--reference requires the poses of --batch or --protein/--ligands")
+        return run_diff(args)
+    if args.lname:
+        return run_batch(args, args.lname, process_ligand_item, get_ligand_item_key, init_receptor, (args,))
+    if args.batch:
+        return run_batch(args, args.batch, process_batch_item, get_batch_item_key, setup=SPLIT_SETUP)
+    if args.trajectory:
+        return run_trajectory(args)
+
+    if not args.iname:
+        oechem.OEThrow.Fatal("Either --complex, --batch or --trajectory is required")
 
     iname = args.iname
-    ifs = oechem.oemolistream()
-    if not ifs.open(iname):
-        oechem.OEThrow.Fatal("Unable to open %s for reading" % iname)
-
-    complexmol = oechem.OEGraphMol()
-    if not oechem.OEReadMolecule(ifs, complexmol):
-        oechem.OEThrow.Fatal("Unable to read molecule from %s" % iname)
-
-    if not oechem.OEHasResidues(complexmol):
-        oechem.OEPerceiveResidues(complexmol, oechem.OEPreserveResInfo_All)
-
-    # Separate ligand and protein
-
-    sopts = oechem.OESplitMolComplexOptions()
-    oechem.OESetupSplitMolComplexOptions(sopts, itf)
-
-    ligand = oechem.OEGraphMol()
-    protein = oechem.OEGraphMol()
-    water = oechem.OEGraphMol()
-    other = oechem.OEGraphMol()
-
-    pfilter = sopts.GetProteinFilter()
-    wfilter = sopts.GetWaterFilter()
-    sopts.SetProteinFilter(oechem.OEOrRoleSet(pfilter, wfilter))
-    sopts.SetWaterFilter(
-          oechem.OEMolComplexFilterFactory(oechem.OEMolComplexFilterCategory_Nothing))
-
-    oechem.OESplitMolComplex(ligand, protein, water, other, complexmol, sopts)
-
-    if ligand.NumAtoms() == 0:
-        oechem.OEThrow.Fatal("Cannot separate complex!")
-
-    # Perceive interactions
-
-    asite = perceive_interaction_hints_user_def_params(protein,ligand,args)
-   
-    list_type_contacts= ["hbond", "halogen","stacking","sbridge","cation-pi","clashcontact","contact"]
-    get_protein_interactions(asite, list_type_contacts,args.subsites) 
-
-def perceive_interaction_hints_user_def_params(protein, ligand, args):
-    """
-    :type protein: oechem.OEMol
-    :type ligand: oechem.OEMol
-    :rtype: oechem.OEInteractionHintContainer
-    """
-    asite = oechem.OEInteractionHintContainer()
-    asite.AddMolecule(protein, oechem.OEProteinInteractionHintComponent())
-    asite.AddMolecule(ligand, oechem.OELigandInteractionHintComponent())
-    if not oechem.OEIsValidActiveSite(asite):
-        oechem.OEThrow.Fatal("Cannot initialize active site!")
-
-    opts = oechem.OEPerceiveInteractionOptions()
-    opts.SetMaxHBondDistance(args.hbond) # Default : 3.2A
-    opts.SetMaxNonIdealHBondDistance(args.hbondni) # Default : 3.7A
-    opts.SetMaxChargeAidedHBondDistance(args.hbondca) # Default : 3.5A
-    opts.SetMaxContactFraction(args.contact) # Default : 1.2A
-    opts.SetMaxHalogenBondDistance(args.halogenbond) # Default : 3.2A   
-    opts.SetMaxPiStackDistance(args.pistack) # Default : 5.0
-    opts.SetMaxTStackDistance(args.tstack) # Default : 5.35
-    opts.SetMaxSaltBridgeDistance(args.saltbridge) # Default : 5.0A
-    opts.SetMaxCationPiDistance(args.cationpi) # Default : 5.5A
-    opts.SetMinContactFraction(args.clashcontact) # Default : 0.8A
-    oechem.OEPerceiveInteractionHints(asite, opts)
-
-    return asite
-
-
-
-def GetResidueName(residue):
-    return {"ResName_Prot": residue.GetName(), "ResID_Prot": residue.GetResidueNumber(), "ChainID_Prot": residue.GetChainID()}
-
-def GetSubsite(subsite, resid):
-    if subsite == 1: 
-        subsites = {"SS01":[30,71,108,115,118], "SS02":[32,228], "SS03":[72,73,107], "SS04":[230,231], "SS05":[34,198], "SS06":[110], "SS07":[232,233,235,325], "SS08":[35,69,70,76,126,128], "SS09":[11,13,14,229,335], "SS10":[224,226,329,332]}
-        for sub in subsites:
-            if resid in subsites[sub]:
-                return sub
-    return None
-
-def GetResidBACE2(resid):
-    '''if resid < 165:
-        return resid + 16
-    elif resid < 318:
-        return resid + 13
-    else: 
-        return resid + 12''' # non-normalized 
-
-
-def get_interactions(interactiontype):
-    if interactiontype == "stacking":
-        interactiontype = oechem.OEAndInteractionHint(oechem.OEIsStackingInteractionHint(),oechem.OEIsInterInteractionHint())
-    elif interactiontype == "hbond":
-        interactiontype = oechem.OEAndInteractionHint(oechem.OEIsHBondInteractionHint(),oechem.OEIsInterInteractionHint())
-    elif interactiontype == "sbridge":
-        interactiontype = oechem.OEAndInteractionHint(oechem.OEIsSaltBridgeInteractionHint(),oechem.OEIsInterInteractionHint())
-    elif interactiontype == "halogen":
-        interactiontype = oechem.OEAndInteractionHint(oechem.OEIsHalogenBondInteractionHint(),oechem.OEIsInterInteractionHint())
-    elif interactiontype == "cation-pi":
-        interactiontype = oechem.OEAndInteractionHint(oechem.OEIsCationPiInteractionHint(),oechem.OEIsInterInteractionHint())
-    elif interactiontype == "clashcontact":
-        interactiontype = oechem.OEAndInteractionHint(oechem.OEIsClashInteractionHint(),oechem.OEIsInterInteractionHint())
-    elif interactiontype == "contact":
-        interactiontype = oechem.OEAndInteractionHint(oechem.OEIsContactInteractionHint(),oechem.OEIsInterInteractionHint())
-    return interactiontype
-
-
-
-def get_protein_interactions(asite,list_type_contacts,subsites):
-    prot = asite.GetMolecule(oechem.OEProteinInteractionHintComponent())
-    fields = ["ResName_Prot","ResID_Prot","ChainID_Prot","AtomName_Prot","AtomsName_Lig","ContactType","Subsite"]
-    listinteractions = []
-
-    ftsv = open("interactions.tsv", "w")
-    fjson = open("interactions.json", "w")
-    
-    writer_tsv = csv.DictWriter(ftsv, fields, delimiter='\t')
-    writer_tsv.writeheader()
-    
-    for ContactType in list_type_contacts:
-        atoms = list()
-        for atom in prot.GetAtoms():
-            if asite.HasInteraction(oechem.OEAndInteractionHint(oechem.OEHasInteractionHint(atom), get_interactions(ContactType))):
-                atoms.append(atom)
-        
-        for i in atoms:
-            ligatom = set()
-            residue = oechem.OEAtomGetResidue(i)
-            
-            if "HOH" not in residue.GetName() and "TIP" not in residue.GetName():
-                for inter in asite.GetInteractions(oechem.OEHasInteractionHint(i)):
-                    ligfrag = inter.GetFragment(oechem.OELigandInteractionHintComponent())
-                    if ligfrag is None:
-                        continue
-                    for latom in ligfrag.GetAtoms():
-                        ligatom.add(str(latom).strip().replace(" ",""))
-                interaction = GetResidueName(residue)
-                interaction["AtomName_Prot"] = i.GetName()
-                interaction["AtomsName_Lig"] = list(ligatom)
-                interaction["ContactType"] = ContactType
-                if subsites == 1: 
-                    subsite = GetSubsite(subsites, interaction["ResID_Prot"])
-                    interaction["Subsite"] = subsite
-                else:
-                    interaction["Subsite"] = None
-                listinteractions.append(interaction)
-    len_listinteractions = len(listinteractions)
-    i = 1
-    print("[", file=fjson)
-    for dic in listinteractions:
-        writer_tsv.writerow(dic)
-        json_object = json.dumps(dic, indent = 4)
-        if i < len_listinteractions: 
-            print(json_object+",", file=fjson)
-        else:
-            print(json_object+"]", file=fjson)
-        i += 1
-    ftsv.close()
-    fjson.close()
-    return None
-
-InterfaceData = '''
-!BRIEF printinteractions [-complex] <input>
-
-!CATEGORY "input/output options :"
-
-  !PARAMETER -complex
-    !ALIAS -c
-    !TYPE string
-    !KEYLESS 1
-    !REQUIRED true
-    !VISIBILITY simple
-    !BRIEF Input filename of the protein complex
-  !END
+    if args.sweep:
+        return run_sweep(args, parse_sweep(args.sweep))
+
+    start_profile(args, get_input_stem(iname))
+    if args.benchmark > 0:
+        asite, error = perceive_complex(iname, None, args)
+        if asite is None:
+            oechem.OEThrow.Fatal(error)
+        benchmark_protein_interactions(asite, LIST_TYPE_CONTACTS, get_subsite_map(args), args.benchmark)
+        interactions = iter_protein_interactions(asite, LIST_TYPE_CONTACTS, get_subsite_map(args))
+    else:
+        interactions, error = extract_interactions(args, get_complex_setup(args), [iname], perceive_complex, iname, None, args)
+        if interactions is None:
+            oechem.OEThrow.Fatal(error)
+    if args.columnar:
+        interactions = list(interactions)
+    write_interactions(interactions, args.tsvname, args.jsonname)
+    if args.columnar:
+        columnar = ColumnarWriter(args.columnar, args.fingerprint)
+        columnar.Add(get_input_stem(iname), interactions)
+        columnar.Close()
+    report_profiles(args, [finish_profile()])
+    return 0
 
-!END
-'''
 
 if __name__ == "__main__":
     sys.exit(main(sys.argv))
@@ -22,237 +22,131 @@
 
 import sys
 from openeye import oechem
-from openeye import oedepict
-from openeye import oegrapheme
 import argparse
+import os
+from activesite.options import add_perception_arguments
+from activesite.perception import get_perceive_options
+from activesite.batch import perceive_complex, init_receptor
+from activesite.store import add_store_arguments, is_store
+from activesite.cache import add_cache_arguments, open_cache, get_hints_key, load_cached_hints, store_cached_hints
+from activesite.profiling import add_profile_arguments, start_profile, finish_profile, report_profiles
+from activesite.depiction import (MAP_SPLIT_SETUP, get_image_size, is_image_format, write_activesite_map,
+                                  render_batch, get_item_activesite)
 
 def main(argv=[__name__]):
 
-    itf = oechem.OEInterface()
-    oechem.OEConfigure(itf, InterfaceData)
-    oedepict.OEConfigureImageWidth(itf, 900.0)
-    oedepict.OEConfigureImageHeight(itf, 600.0)
-    oechem.OEConfigureSplitMolComplexOptions(itf, oechem.OESplitMolComplexSetup_LigName |
-                                             oechem.OESplitMolComplexSetup_CovLig)
-
-    #if not oechem.OEParseCommandLine(itf, argv):
-    #    return 1
-    
     argParser = argparse.ArgumentParser()
-    argParser.add_argument("--complex", help="Complex Input", dest="iname", required=True)
-    argParser.add_argument("--out", help="Output in ONLY SVG", dest="oname", default="interactions.svg")
-    argParser.add_argument("--pname", help="Protein Input", dest="pname", default="")
-    argParser.add_argument("--lname", help="Ligand Input", dest="lname", default="")
-    argParser.add_argument("--hbond", help="Maximum Distance of Hydrogen Bond (default=3.2A)", type=float, default=3.2)
-    argParser.add_argument("--hbondni", help="Maximum Distance of Non-Ideal Hydrogen Bond (default=3.7A)", type=float, default=3.8)
-    argParser.add_argument("--hbondca", help="Maximum Distance of Charge-Aided Hydrogen Bond (default=3.5A)", type=float, default=3.5)
-    argParser.add_argument("--halogenbond", help="Maximum Distance of Halogen Bond (default=3.2A)", type=float, default=3.2)
-    argParser.add_argument("--pistack", help="Maximum Distance of Pi-Stacking (default=5.0A)", type=float, default=5.0)
-    argParser.add_argument("--tstack", help="Maximum Distance of T-Stacking (default=5.35A)", type=float, default=5.35)
-    argParser.add_argument("--saltbridge", help="Maximum Distance of Salt Bridge (default=5.0A)", type=float, default=5.0)
-    argParser.add_argument("--cationpi", help="Maximum Distance of Cation-Pi (default=5.5A)", type=float, default=5.5)
-    argParser.add_argument("--contact", help="Maximum Distance of Contacts (default=1.2A)", type=float, default=1.2)
-    argParser.add_argument("--clashcontact", help="Minimum Distance of Clash-Contacts (default=0.8A)", type=float, default=0.8)
-    args = argParser.parse_args()
-
+    argParser.add_argument("--complex", help="Complex Input", dest="iname", default="")
+    argParser.add_argument("--out", help="Output image (default=interactions.svg)", dest="oname", default="interactions.svg")
+    argParser.add_argument("--pname", help="Protein Input, prepared once for all ligands of --lname", dest="pname", default="")
+    argParser.add_argument("--lname", help="Ligand Input, one map per molecule, rendered as a batch into the directory of --out when more than one (<title>.<format>)", dest="lname", default="")
+    argParser.add_argument("--pocket", help="Crop the protein to whole residues within this radius of each ligand, 0 keeps the whole protein (default=0)", type=float, default=0.0)
+    argParser.add_argument("--batch", help="Render many complexes: directory or glob of complex files, or a multi-molecule file", dest="batch", default="")
+    argParser.add_argument("--jobs", help="Number of worker processes for batch rendering (default=1)", type=int, default=1)
+    argParser.add_argument("--outdir", help="Batch rendering: directory of the per-pose images <name>.<format> (default=.)", default="")
+    argParser.add_argument("--format", help="Batch rendering: image format of the per-pose images, e.g. svg, png, pdf (default=svg, or the format of --out for the poses of --lname)", default="")
+    argParser.add_argument("--multipage", help="Batch rendering: write all maps into this multi-page document (e.g. maps.pdf) instead of one file per pose", default="")
+    argParser.add_argument("--grid", help="Batch rendering: ROWSxCOLS maps per page of --multipage (default=1x1)", default="1x1")
+    add_perception_arguments(argParser)
+    add_store_arguments(argParser)
+    add_cache_arguments(argParser)
+    add_profile_arguments(argParser)
+    args = argParser.parse_args(argv[1:])
+
+    try:
+        return run(args)
+    except (IOError, ImportError, ValueError) as err:
+        oechem.OEThrow.Fatal(str(err))
+
+
+def run(args):
+
+    if args.store and not is_store(args.store):
+        oechem.OEThrow.Fatal("No prepared-structure store in %s" % args.store)
     oname = args.oname
 
-    ext = oechem.OEGetFileExtension(oname)
-    if ext != "svg":
-        oechem.OEThrow.Fatal("Only available for SVG image type!")
-
-    ofs = oechem.oeofstream()
-    if not ofs.open(oname):
-        oechem.OEThrow.Fatal("Cannot open output file!")
-
-    # initialize protein and ligand
-
-    protein = oechem.OEGraphMol()
-    ligand = oechem.OEGraphMol()
-    if not get_protein_and_ligands(protein, ligand, itf, args):
-        oechem.OEThrow.Fatal("Cannot initialize protein and/or ligand!")
-
-    # depict active site maps
-
-    width, height = oedepict.OEGetImageWidth(itf), oedepict.OEGetImageHeight(itf)
-    image = oedepict.OEImage(width, height)
-
-    depict_activesite_maps(image, protein, ligand, args)
-
-    oedepict.OEDrawCurvedBorder(image, oedepict.OELightGreyPen, 10.0)
-
-    oedepict.OEWriteImage(oname, image)
-
+    if args.batch or args.multipage or args.outdir or args.jobs > 1:
+        if not args.batch and not (args.pname and args.lname):
+            oechem.OEThrow.Fatal("Batch rendering requires --batch or both --pname and --lname!")
+        return render_batch(args)
+
+    if not is_image_format(oechem.OEGetFileExtension(oname)):
+        oechem.OEThrow.Fatal("Unknown image type!")
+
+    if not args.iname and not (args.pname and args.lname):
+        oechem.OEThrow.Fatal("Either --complex or both --pname and --lname are required!")
+
+    width, height = get_image_size()
+
+    print_perception_options(args)
+
+    cache = open_cache(args)
+
+    if args.iname:
+
+        start_profile(args, oname)
+        asite = None
+        if cache is not None:
+            key = get_hints_key(args, MAP_SPLIT_SETUP, [args.iname])
+            asite = load_cached_hints(cache, key)
+
+        if asite is None:
+            asite, error = perceive_complex(args.iname, None, args, MAP_SPLIT_SETUP)
+            if asite is None:
+                oechem.OEThrow.Fatal(error)
+            if cache is not None:
+                store_cached_hints(cache, key, asite)
+
+        write_activesite_map(oname, asite, width, height)
+        report_profiles(args, [finish_profile()])
+        return 0
+
+    # several poses are rendered like a batch, each pose on its own, and a
+    # single pose inline
+
+    ligands = iter_ligands(args.lname)
+    ligand = next(ligands, None)
+    if ligand is None:
+        oechem.OEThrow.Fatal("Unable to read ligand from %s" % args.lname)
+    if next(ligands, None) is not None:
+        args.outdir = os.path.dirname(oname) or "."
+        args.format = args.format or oechem.OEGetFileExtension(oname)
+        return render_batch(args)
+
+    start_profile(args, oname)
+    init_receptor(args)
+    asite, error = get_item_activesite((oname, args.lname, oechem.OEWriteMolToBytes(".oeb", ligand)), args)
+    if asite is None:
+        oechem.OEThrow.Fatal("%s: %s" % (args.lname, error))
+    write_activesite_map(oname, asite, width, height)
+    report_profiles(args, [finish_profile()])
     return 0
 
 
-def perceive_interation_hints_user_def_params(protein, ligand, args):
-    """
-    :type protein: oechem.OEMol
-    :type ligand: oechem.OEMol
-    :rtype: oechem.OEInteractionHintContainer
-    """
-    asite = oechem.OEInteractionHintContainer()
-    asite.AddMolecule(protein, oechem.OEProteinInteractionHintComponent())
-    asite.AddMolecule(ligand, oechem.OELigandInteractionHintComponent())
-    if not oechem.OEIsValidActiveSite(asite):
-        oechem.OEThrow.Fatal("Cannot initialize active site!")
+def print_perception_options(args):
 
-    opts = oechem.OEPerceiveInteractionOptions()
-    opts.SetMaxHBondDistance(args.hbond) # Default : 3.2A
-    opts.SetMaxNonIdealHBondDistance(args.hbondni) # Default : 3.8A
-    opts.SetMaxChargeAidedHBondDistance(args.hbondca) # Default : 3.5A
-    opts.SetMaxContactFraction(args.contact) # Default : 1.2A
-    opts.SetMaxHalogenBondDistance(args.halogenbond) # Default : 3.2A   
-    opts.SetMaxPiStackDistance(args.pistack) # Default : 5.0
-    opts.SetMaxTStackDistance(args.tstack) # Default : 5.35
-    opts.SetMaxSaltBridgeDistance(args.saltbridge) # Default : 5.0A
-    opts.SetMaxCationPiDistance(args.cationpi) # Default : 5.5A
-    opts.SetMinContactFraction(args.clashcontact) # Default : 0.8A
+    opts = get_perceive_options(args)
     print("Hydrogen Bond", opts.GetMaxHBondDistance()) # Default : 3.2A
-    print("Non-Ideal Hydrogen Bond", opts.GetMaxNonIdealHBondDistance()) # Default : 3.7A
+    print("Non-Ideal Hydrogen Bond", opts.GetMaxNonIdealHBondDistance()) # Default : 3.8A
     print("Max Charge Aided Hydrogen Bond", opts.GetMaxChargeAidedHBondDistance()) # Default : 3.5A
-    print("Min Contact", opts.GetMinContactFraction()) # Default : 0.8A
-    print("Max Contact", opts.GetMaxContactFraction()) # Default : 1.2A
-    print("Max Halogen Bond", opts.GetMaxHalogenBondDistance()) # Default : 3.2A   
-    print("Max Pi Stack", opts.GetMaxPiStackDistance()) # Default : 5.0
-    print("Max T Stack", opts.GetMaxTStackDistance()) # Default : 5.35
+    print("Min Contact", opts.GetMinContactFraction()) # Default : 0.8
+    print("Max Contact", opts.GetMaxContactFraction()) # Default : 1.2
+    print("Max Halogen Bond", opts.GetMaxHalogenBondDistance()) # Default : 3.2A
+    print("Max Pi Stack", opts.GetMaxPiStackDistance()) # Default : 5.0A
+    print("Max T Stack", opts.GetMaxTStackDistance()) # Default : 5.35A
     print("Max Salt Bridge", opts.GetMaxSaltBridgeDistance()) # Default : 5.0A
     print("Max Cation Pi", opts.GetMaxCationPiDistance()) # Default : 5.5A
-    oechem.OEPerceiveInteractionHints(asite, opts)
-
-    return asite
-
-
-def depict_activesite_maps(image, protein, ligand, args):
-    """
-    :type image: oedepict.OEImageBase
-    :type protein: oechem.OEMolBase
-    :type ligand: oechem.OEMolBase
-    """
-
-    # perceive interactions
-
-    #asite = oechem.OEInteractionHintContainer(protein, ligand)
-    asite = perceive_interation_hints_user_def_params(protein,ligand,args)
-    if not asite.IsValid():
-        oechem.OEThrow.Fatal("Cannot initialize active site!")
-    asite.SetTitle(ligand.GetTitle())
-
-    #oechem.OEPerceiveInteractionHints(asite)
-
-    # depiction
-
-    oegrapheme.OEPrepareActiveSiteDepiction(asite)
-    oegrapheme.OERenderActiveSiteMaps(image, asite)
-
-
-def split_complex(protein, ligand, sopts, complexmol):
-
-    water = oechem.OEGraphMol()
-    other = oechem.OEGraphMol()
-
-    pfilter = sopts.GetProteinFilter()
-    wfilter = sopts.GetWaterFilter()
-    sopts.SetProteinFilter(oechem.OEOrRoleSet(pfilter, wfilter))
-    filter = oechem.OEMolComplexFilterCategory_Nothing
-    sopts.SetWaterFilter(oechem.OEMolComplexFilterFactory(filter))
-
-    oechem.OESplitMolComplex(ligand, protein, water, other, complexmol, sopts)
-
-    return ligand.NumAtoms() != 0 and protein.NumAtoms() != 0
-
-
-def get_protein_and_ligands(protein, ligand, itf, args):
-
-    if (args.iname):
-
-        # separate ligand and protein in complex
-
-        iname = args.iname
-
-        ifs = oechem.oemolistream()
-        if not ifs.open(iname):
-            oechem.OEThrow.Fatal("Cannot open input complex file!")
-
-        complexmol = oechem.OEGraphMol()
-        if not oechem.OEReadMolecule(ifs, complexmol):
-            oechem.OEThrow.Fatal("Unable to read complex from %s" % iname)
-
-        if not oechem.OEHasResidues(complexmol):
-            oechem.OEPerceiveResidues(complexmol, oechem.OEPreserveResInfo_All)
-
-        sopts = oechem.OESplitMolComplexOptions()
-        oechem.OESetupSplitMolComplexOptions(sopts, itf)
-
-        if not split_complex(protein, ligand, sopts, complexmol):
-            oechem.OEThrow.Fatal("Cannot separate complex!")
-    else:
-
-        # read ligand and protein from separate files
-
-        pname = args.pname
-
-        ifs = oechem.oemolistream()
-        if not ifs.open(pname):
-            oechem.OEThrow.Fatal("Cannot open input protein file!")
-
-        if not oechem.OEReadMolecule(ifs, protein):
-            oechem.OEThrow.Fatal("Unable to read protein from %s" % pname)
-
-        lname = args.lname
-
-        ifs = oechem.oemolistream()
-        if not ifs.open(lname):
-            oechem.OEThrow.Fatal("Cannot open input ligand file!")
-
-        if not oechem.OEReadMolecule(ifs, ligand):
-            oechem.OEThrow.Fatal("Unable to read ligand from %s" % lname)
-
-    return ligand.NumAtoms() != 0 and protein.NumAtoms() != 0
-
-
-#############################################################################
-# INTERFACE
-#############################################################################
-
-InterfaceData = '''
-!CATEGORY "input/output options :" 1
 
-  !PARAMETER -complex 1
-    !ALIAS -c
-    !TYPE string
-    !REQUIRED false
-    !VISIBILITY simple
-    !BRIEF Input filename of the protein-ligand complex
-  !END
 
-  !PARAMETER -protein 2
-    !ALIAS -p
-    !TYPE string
-    !REQUIRED false
-    !VISIBILITY simple
-    !BRIEF Input filename of the protein
-  !END
+def iter_ligands(lname):
 
-  !PARAMETER -ligand 3
-    !ALIAS -l
-    !TYPE string
-    !REQUIRED false
-    !VISIBILITY simple
-    !BRIEF Input filename of the ligand
-  !END
+    ifs = oechem.oemolistream()
+    if not ifs.open(lname):
+        oechem.OEThrow.Fatal("Cannot open input ligand file!")
 
-  !PARAMETER -out 4
-    !ALIAS -o
-    !TYPE string
-    !REQUIRED true
-    !VISIBILITY simple
-    !BRIEF Output filename of the generated image
-  !END
+    for mol in ifs.GetOEGraphMols():
+        yield oechem.OEGraphMol(mol)
 
-!END
-'''
 
 if __name__ == "__main__":
     sys.exit(main(sys.argv))
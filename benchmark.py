@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+
+#############################################################################
+# Benchmarks the extraction and depiction paths on synthetic complexes
+#############################################################################
+import sys
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent import futures
+
+# residue templates: side chain atoms (name, element, x, y, z) relative to CA,
+# z pointing away from the strand (flipped on every other residue)
+SIDECHAINS = {
+    "GLY": [],
+    "ALA": [("CB", "C", 0.0, 0.0, 1.53)],
+    "SER": [("CB", "C", 0.0, 0.0, 1.53), ("OG", "O", 0.8, 0.0, 2.75)],
+    "ASP": [("CB", "C", 0.0, 0.0, 1.53), ("CG", "C", 0.85, 0.0, 2.8),
+            ("OD1", "O", 0.4, 0.0, 3.9), ("OD2", "O", 2.05, 0.0, 2.5)],
+    "LYS": [("CB", "C", 0.0, 0.0, 1.53), ("CG", "C", 0.85, 0.0, 2.8), ("CD", "C", 0.0, 0.0, 4.07),
+            ("CE", "C", 0.85, 0.0, 5.34), ("NZ", "N", 0.0, 0.0, 6.5)],
+    "PHE": [("CB", "C", 0.0, 0.0, 1.53), ("CG", "C", 0.0, 0.0, 3.03),
+            ("CD1", "C", 1.2, 0.0, 3.73), ("CD2", "C", -1.2, 0.0, 3.73),
+            ("CE1", "C", 1.2, 0.0, 5.12), ("CE2", "C", -1.2, 0.0, 5.12), ("CZ", "C", 0.0, 0.0, 5.82)],
+    "TYR": [("CB", "C", 0.0, 0.0, 1.53), ("CG", "C", 0.0, 0.0, 3.03),
+            ("CD1", "C", 1.2, 0.0, 3.73), ("CD2", "C", -1.2, 0.0, 3.73),
+            ("CE1", "C", 1.2, 0.0, 5.12), ("CE2", "C", -1.2, 0.0, 5.12), ("CZ", "C", 0.0, 0.0, 5.82),
+            ("OH", "O", 0.0, 0.0, 7.18)],
+}
+
+SEQUENCE = ["SER", "PHE", "ASP", "ALA", "LYS", "TYR", "GLY", "ASP", "SER", "LYS", "ALA", "PHE"]
+
+# benzamidine-like ligand with a carboxylate, in the xy plane around the origin
+LIGAND = [("C1", "C", 1.39, 0.0), ("C2", "C", 0.695, 1.204), ("C3", "C", -0.695, 1.204),
+          ("C4", "C", -1.39, 0.0), ("C5", "C", -0.695, -1.204), ("C6", "C", 0.695, -1.204),
+          ("C7", "C", 2.89, 0.0), ("N1", "N", 3.55, 1.15), ("N2", "N", 3.55, -1.15),
+          ("C8", "C", -2.89, 0.0), ("O1", "O", -3.52, 1.09), ("O2", "O", -3.52, -1.09)]
+
+STRAND_SPACING = 5.5
+SHEET_SPACING = 15.0
+RISE = 1.27
+
+# name -> (number of strands, residues per strand, number of sheets, one chain per sheet,
+#          pocket radius (0 keeps the whole receptor), water padding (0 for no water))
+CASES = {
+    "small_pocket": (8, 12, 3, False, 12.0, 0.0),
+    "full_receptor": (8, 12, 3, False, 0.0, 0.0),
+    "multi_chain": (8, 12, 4, True, 0.0, 0.0),
+    "solvated": (8, 12, 3, False, 0.0, 8.0),
+}
+
+PATHS = ["extract", "scan", "prefilter", "records", "depict"]
+
+
+def main(argv=[__name__]):
+
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("--cases", help="Comma-separated cases (default=%s)" % ",".join(sorted(CASES)), default=",".join(sorted(CASES)))
+    argParser.add_argument("--paths", help="Comma-separated paths among %s (default=extract,prefilter,records,depict)" % ",".join(PATHS), default="extract,prefilter,records,depict")
+    argParser.add_argument("--scale", help="Multiplies the number of strands of every case (default=1)", type=int, default=1)
+    argParser.add_argument("--repeat", help="Complexes processed per case and path (default=5)", type=int, default=5)
+    argParser.add_argument("--workdir", help="Directory of the generated structures and outputs (default=temporary)")
+    argParser.add_argument("--baseline", help="Compare against this stored result file")
+    argParser.add_argument("--save", help="Store the results into this file, to be used as --baseline")
+    argParser.add_argument("--tolerance", help="Relative slowdown or memory growth reported as regression (default=0.1)", type=float, default=0.1)
+    argParser.add_argument("--no-isolate", help="Run every case in this process instead of a fresh one (peak RSS is then cumulative)", dest="isolate", action="store_false")
+    argParser.add_argument("--generate", help="Only write the synthetic complexes into --workdir", action="store_true")
+    args = argParser.parse_args(argv[1:])
+
+    cases = [case for case in args.cases.split(",") if case]
+    paths = [path for path in args.paths.split(",") if path]
+    for case in cases:
+        if case not in CASES:
+            sys.exit("Unknown case %s, choose from %s" % (case, ", ".join(sorted(CASES))))
+    for path in paths:
+        if path not in PATHS:
+            sys.exit("Unknown path %s, choose from %s" % (path, ", ".join(PATHS)))
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="activesite-benchmark-")
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+
+    complexes = {}
+    for case in cases:
+        complexes[case] = os.path.join(workdir, "%s_x%d.pdb" % (case, args.scale))
+        with open(complexes[case], "w") as f:
+            f.write(generate_complex(case, args.scale))
+    if args.generate:
+        for case in cases:
+            print(complexes[case])
+        return 0
+
+    results = {}
+    for case in cases:
+        for path in paths:
+            if args.isolate:
+                context = multiprocessing.get_context("spawn")
+                with futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    result = pool.submit(run_case, complexes[case], path, args.repeat, workdir).result()
+            else:
+                result = run_case(complexes[case], path, args.repeat, workdir)
+            results.setdefault(case, {})[path] = result
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    nregressions = report(results, baseline, args.tolerance)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"scale": args.scale, "repeat": args.repeat, "results": results}, f, indent=1)
+
+    return 1 if nregressions else 0
+
+
+#############################################################################
+# SYNTHETIC COMPLEXES
+#############################################################################
+
+def generate_complex(case, scale=1):
+    """
+    Builds a stand-in protein-ligand complex as PDB text: sheets of extended
+    strands of idealized residues packed in a box, with a ligand in a cavity
+    carved at its center, optionally cropped to a pocket and solvated.
+
+    :rtype: str
+    """
+    nstrands, length, nsheets, multichain, pocket, padding = CASES[case]
+    nstrands *= scale
+
+    center = (RISE * 3 * length / 2.0, STRAND_SPACING * (nstrands - 1) / 2.0, SHEET_SPACING * (nsheets - 1) / 2.0)
+    ligand = [(name, elem, center[0] + x, center[1] + y, center[2]) for name, elem, x, y in LIGAND]
+
+    residues = []
+    for sheet in range(nsheets):
+        chain = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"[sheet % 26] if multichain else "A"
+        for strand in range(nstrands):
+            for i in range(length):
+                resnum = (sheet * nstrands + strand) * length + i + 1
+                if multichain:
+                    resnum = strand * length + i + 1
+                resname = SEQUENCE[(strand * 5 + i) % len(SEQUENCE)]
+                atoms = build_residue(resname, i, strand * STRAND_SPACING, sheet * SHEET_SPACING)
+                residues.append((resname, chain, resnum, atoms))
+
+    # carve the cavity and crop to the pocket
+
+    kept = []
+    for resname, chain, resnum, atoms in residues:
+        if min_distance(atoms, ligand) < 3.0:
+            continue
+        if pocket > 0 and min_distance(atoms, [("", "", center[0], center[1], center[2])]) > pocket:
+            continue
+        kept.append((resname, chain, resnum, atoms))
+
+    lines = []
+    serial = 1
+    for resname, chain, resnum, atoms in kept:
+        for name, elem, x, y, z in atoms:
+            lines.append(format_atom("ATOM", serial, name, resname, chain, resnum, x, y, z, elem))
+            serial += 1
+    for name, elem, x, y, z in ligand:
+        lines.append(format_atom("HETATM", serial, name, "LIG", "X", 1, x, y, z, elem))
+        serial += 1
+
+    if padding > 0:
+        solute = [atom for resname, chain, resnum, atoms in kept for atom in atoms] + ligand
+        resnum = 1
+        for x, y, z in generate_waters(solute, padding):
+            lines.append(format_atom("HETATM", serial, "O", "HOH", "W", resnum, x, y, z, "O"))
+            serial += 1
+            resnum += 1
+
+    lines.append("END")
+    return "\n".join(lines) + "\n"
+
+
+def build_residue(resname, i, y0, z0):
+    """
+    :rtype: list of (name, element, x, y, z)
+    """
+
+    # planar zigzag backbone along x, 3 atoms and 3.81A per residue
+
+    def zigzag(j):
+        return RISE * j, y0 + (0.35 if j % 2 == 0 else -0.35)
+
+    atoms = []
+    for k, (name, elem) in enumerate([("N", "N"), ("CA", "C"), ("C", "C")]):
+        x, y = zigzag(3 * i + k)
+        atoms.append((name, elem, x, y, z0))
+    cx, cy = zigzag(3 * i + 2)
+    atoms.append(("O", "O", cx, cy + math.copysign(1.23, cy - y0), z0))
+
+    cax, cay = zigzag(3 * i + 1)
+    zsign = 1.0 if i % 2 == 0 else -1.0
+    for name, elem, x, y, z in SIDECHAINS[resname]:
+        atoms.append((name, elem, cax + x, cay + y, z0 + zsign * z))
+    return atoms
+
+
+def generate_waters(solute, padding, spacing=3.1, mindist=2.8):
+    """
+    Fills the solute bounding box, padded, with a water lattice that avoids
+    the solute atoms.
+
+    :rtype: list of (x, y, z)
+    """
+    lo = [min(atom[2 + i] for atom in solute) - padding for i in range(3)]
+    hi = [max(atom[2 + i] for atom in solute) + padding for i in range(3)]
+
+    cells = {}
+    for atom in solute:
+        cells.setdefault(tuple(int(atom[2 + i] // mindist) for i in range(3)), []).append(atom[2:])
+
+    waters = []
+    n = [int((hi[i] - lo[i]) / spacing) + 1 for i in range(3)]
+    for ix in range(n[0]):
+        for iy in range(n[1]):
+            for iz in range(n[2]):
+                xyz = (lo[0] + ix * spacing, lo[1] + iy * spacing, lo[2] + iz * spacing)
+                cell = tuple(int(xyz[i] // mindist) for i in range(3))
+                clash = False
+                for dx in (-1, 0, 1):
+                    for dy in (-1, 0, 1):
+                        for dz in (-1, 0, 1):
+                            for other in cells.get((cell[0] + dx, cell[1] + dy, cell[2] + dz), ()):
+                                if sum((xyz[i] - other[i]) ** 2 for i in range(3)) < mindist * mindist:
+                                    clash = True
+                if not clash:
+                    waters.append(xyz)
+    return waters
+
+
+def min_distance(atoms, others):
+    return math.sqrt(min((a[2] - b[2]) ** 2 + (a[3] - b[3]) ** 2 + (a[4] - b[4]) ** 2
+                         for a in atoms for b in others))
+
+
+def format_atom(record, serial, name, resname, chain, resnum, x, y, z, elem):
+    if len(name) < 4:
+        name = " " + name
+    return "%-6s%5d %-4s %3s %1s%4d    %8.3f%8.3f%8.3f%6.2f%6.2f          %2s" % (
+        record, serial % 100000, name, resname, chain, resnum % 10000, x, y, z, 1.0, 0.0, elem)
+
+
+#############################################################################
+# RUNNERS
+#############################################################################
+
+def get_default_args(**overrides):
+    """
+    :rtype: argparse.Namespace with the defaults of the perception options
+    """
+    import dataclasses
+    from activesite import PerceptionOptions
+
+    args = argparse.Namespace(subsites=1, subsite_map="bace", no_cache=True, profile=True,
+                              profile_json=None, cprofile=None, jobs=1,
+                              **dataclasses.asdict(PerceptionOptions()))
+    for name, value in overrides.items():
+        setattr(args, name, value)
+    return args
+
+
+def run_case(iname, path, repeat, workdir):
+    """
+    Processes the complex repeat times along path in this process.
+
+    :rtype: dict of throughput, latency, per-stage latency and memory
+    """
+    from activesite import profiling
+    from activesite.batch import get_input_stem
+
+    args = get_path_args(path)
+    stem = os.path.join(workdir, "%s_%s" % (get_input_stem(iname), path))
+    latencies = []
+    records = []
+    for n in range(repeat):
+        profiling.start_profile(args, "%s %d" % (path, n))
+        start = time.perf_counter()
+        if path == "depict":
+            run_depiction(iname, stem + ".svg", args)
+        else:
+            run_extraction(iname, stem, path, args)
+        latencies.append(time.perf_counter() - start)
+        records.append(profiling.finish_profile())
+
+    if path == "prefilter":
+        verify_prefilter(iname, args)
+
+    summary = profiling.summarize_profiles(records)
+    ordered = sorted(latencies)
+    result = {"complexes_per_s": repeat / sum(latencies),
+            "latency_p50": profiling.percentile(ordered, 50),
+            "latency_p90": profiling.percentile(ordered, 90),
+            "maxrss_kb": max(stats["maxrss_kb"] for stats in summary["stages"].values()),
+            "stages": dict((name, stats["wall_p50"]) for name, stats in summary["stages"].items()),
+            "counts": dict((name, stats["max"]) for name, stats in summary["counts"].items())}
+    if path == "records":
+        result["memory_kb"] = measure_records(iname, args, repeat)
+    return result
+
+
+def get_path_args(path):
+    """
+    :rtype: argparse.Namespace of the runs along path
+    """
+    if path == "prefilter":
+        from activesite.perception import PREFILTER_MARGIN
+        return get_default_args(prefilter=True, prefilter_margin=PREFILTER_MARGIN)
+    return get_default_args()
+
+
+def run_extraction(iname, stem, path, args):
+    from activesite.batch import perceive_complex
+    from activesite.extraction import (LIST_TYPE_CONTACTS, iter_protein_interactions,
+                                       iter_protein_interactions_per_type_scan)
+    from activesite.records import extract_table
+    from activesite.subsites import get_subsite_map
+    from activesite.output import write_interactions
+    from activesite.profiling import profile_stage
+
+    asite, error = perceive_complex(iname, None, args)
+    if asite is None:
+        raise RuntimeError(error)
+    subsites = get_subsite_map(args)
+    if path == "scan":
+        interactions = iter_protein_interactions_per_type_scan(asite, LIST_TYPE_CONTACTS, subsites)
+        with profile_stage("extract"):
+            interactions = list(interactions)
+    elif path == "records":
+        interactions = extract_table(asite, subsites, LIST_TYPE_CONTACTS)
+    else:
+        interactions = iter_protein_interactions(asite, LIST_TYPE_CONTACTS, subsites)
+    write_interactions(interactions, stem + ".tsv", stem + ".jsonl")
+
+
+def verify_prefilter(iname, args):
+    """
+    Checks that the interactions perceived against the pre-filtered pocket
+    are those perceived against the whole protein.
+    """
+    from activesite.batch import perceive_complex
+    from activesite.extraction import extract
+    from activesite.subsites import get_subsite_map
+
+    rows = []
+    for prefilter in (False, True):
+        asite, error = perceive_complex(iname, None, get_default_args(prefilter=prefilter,
+                                                                      prefilter_margin=args.prefilter_margin))
+        if asite is None:
+            raise RuntimeError(error)
+        rows.append([dict(row, AtomsName_Lig=sorted(row["AtomsName_Lig"]))
+                     for row in extract(asite, get_subsite_map(args))])
+    if rows[0] != rows[1]:
+        raise RuntimeError("%s: pre-filtered interactions differ from the whole protein ones (%d vs %d rows)"
+                           % (iname, len(rows[1]), len(rows[0])))
+
+
+def measure_records(iname, args, repeat):
+    """
+    Measures the memory held by the interactions of repeat complexes kept
+    as dict rows and as InteractionTables sharing their string tables, and
+    checks that both hold the same rows.
+
+    :rtype: dict (representation -> kB allocated)
+    """
+    import tracemalloc
+    from activesite.batch import perceive_complex
+    from activesite.extraction import extract
+    from activesite.records import extract_table, make_record_tables
+    from activesite.subsites import get_subsite_map
+
+    asite, error = perceive_complex(iname, None, args)
+    if asite is None:
+        raise RuntimeError(error)
+    subsites = get_subsite_map(args)
+
+    def held(build):
+        tracemalloc.start()
+        try:
+            kept = build()
+            return kept, tracemalloc.get_traced_memory()[0] // 1024
+        finally:
+            tracemalloc.stop()
+
+    rows, dictkb = held(lambda: [extract(asite, subsites) for _ in range(repeat)])
+    tables = make_record_tables()
+    compact, tablekb = held(lambda: [extract_table(asite, subsites, tables=tables) for _ in range(repeat)])
+    if [list(table) for table in compact] != rows:
+        raise RuntimeError("%s: InteractionTable rows differ from the dict rows" % iname)
+    return {"dict": dictkb, "table": tablekb}
+
+
+def run_depiction(iname, oname, args):
+    from activesite.batch import perceive_complex
+    from activesite.depiction import MAP_SPLIT_SETUP, get_image_size, write_activesite_map
+
+    asite, error = perceive_complex(iname, None, args, MAP_SPLIT_SETUP)
+    if asite is None:
+        raise RuntimeError(error)
+    width, height = get_image_size()
+    write_activesite_map(oname, asite, width, height)
+
+
+#############################################################################
+# REPORT
+#############################################################################
+
+def report(results, baseline, tolerance):
+    """
+    Prints the results, compared against baseline when given.
+
+    :rtype: int (number of regressions)
+    """
+    nregressions = 0
+    print("%-14s %-8s %12s %10s %10s %12s %8s %8s" % ("case", "path", "complexes/s", "p50 (s)", "p90 (s)",
+                                                       "maxrss (kB)", "atoms", "speed"))
+    for case in sorted(results):
+        for path, result in sorted(results[case].items()):
+            atoms = result["counts"].get("protein_atoms", 0) + result["counts"].get("ligand_atoms", 0)
+            ratio = ""
+            base = (baseline or {}).get(case, {}).get(path)
+            if base is not None:
+                speed = result["complexes_per_s"] / base["complexes_per_s"]
+                memory = float(result["maxrss_kb"]) / base["maxrss_kb"] if base["maxrss_kb"] else 1.0
+                ratio = "%.2fx" % speed
+                if speed < 1.0 - tolerance or memory > 1.0 + tolerance:
+                    ratio += " REGRESSION"
+                    nregressions += 1
+            print("%-14s %-8s %12.2f %10.4f %10.4f %12d %8d %8s" % (case, path, result["complexes_per_s"],
+                                                                    result["latency_p50"], result["latency_p90"],
+                                                                    result["maxrss_kb"], atoms, ratio))
+            stages = " ".join("%s=%.4f" % item for item in sorted(result["stages"].items(), key=lambda item: -item[1]))
+            print("    p50 per stage: %s" % stages)
+            if "memory_kb" in result:
+                memory = result["memory_kb"]
+                print("    kept in memory: dict rows %d kB, tables %d kB (%.1fx smaller)"
+                      % (memory["dict"], memory["table"], float(memory["dict"]) / max(1, memory["table"])))
+    return nregressions
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+#############################################################################
+# Measures the latency of an interaction server started with
+#   activesiteinteractions.py --serve ADDRESS --jobs N
+#############################################################################
+import sys
+import argparse
+import asyncio
+import json
+import time
+
+def main(argv=[__name__]):
+
+    argParser = argparse.ArgumentParser()
+    argParser.add_argument("--address", help="Address of the server, host:port or Unix socket path (default=127.0.0.1:8765)", default="127.0.0.1:8765")
+    argParser.add_argument("--complex", help="Complex file sent by path (repeatable, requests cycle over them)", dest="inames", action="append", required=True)
+    argParser.add_argument("--requests", help="Total number of requests (default=100)", type=int, default=100)
+    argParser.add_argument("--concurrency", help="Requests in flight at any time (default=8)", type=int, default=8)
+    argParser.add_argument("--connections", help="Client connections the requests are spread over (default=1)", type=int, default=1)
+    argParser.add_argument("--inline", help="Send the complex file contents instead of their paths", action="store_true")
+    argParser.add_argument("--params", help="JSON object of parameter overrides sent with every request, e.g. '{\"hbond\": 3.0}'", default="{}")
+    argParser.add_argument("--json", help="Write the latencies and their summary to this file", dest="jsonname")
+    args = argParser.parse_args(argv[1:])
+
+    summary = asyncio.run(run_load(args))
+    print("requests      %d (%d failed)" % (summary["requests"], summary["failed"]))
+    print("throughput    %.2f requests/s" % summary["throughput"])
+    for key in ("p50", "p90", "p99", "max"):
+        print("latency %-5s %.4f s (worker %.4f s)" % (key, summary["latency"][key], summary["worker"][key]))
+
+    if args.jsonname:
+        with open(args.jsonname, "w") as f:
+            json.dump(summary, f, indent=1)
+    return 1 if summary["failed"] else 0
+
+
+def get_requests(args):
+    """
+    :rtype: list of request dicts, without id
+    """
+    params = json.loads(args.params)
+    requests = []
+    for iname in args.inames:
+        if args.inline:
+            with open(iname) as f:
+                request = {"data": f.read(), "format": iname.rsplit(".", 1)[-1]}
+        else:
+            request = {"path": iname}
+        if params:
+            request["params"] = params
+        requests.append(request)
+    return requests
+
+
+async def run_load(args):
+    from activesite.server import InteractionClient
+
+    requests = get_requests(args)
+    clients = [InteractionClient(args.address) for _ in range(max(1, args.connections))]
+    for client in clients:
+        await client.Connect()
+
+    latencies = []
+    workers = []
+    failed = [0]
+    limit = asyncio.Semaphore(max(1, args.concurrency))
+
+    async def send(n):
+        async with limit:
+            start = time.perf_counter()
+            response = await clients[n % len(clients)].Request(**requests[n % len(requests)])
+            latencies.append(time.perf_counter() - start)
+            workers.append(response.get("elapsed", 0.0))
+            if "error" in response:
+                failed[0] += 1
+                print("request %d: %s" % (n, response["error"]), file=sys.stderr)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[send(n) for n in range(args.requests)])
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        await client.Close()
+
+    return {"requests": args.requests, "failed": failed[0], "concurrency": args.concurrency,
+            "throughput": args.requests / elapsed if elapsed > 0 else 0.0,
+            "latency": summarize(latencies), "worker": summarize(workers), "latencies": latencies}
+
+
+def summarize(values):
+    from activesite.profiling import percentile
+
+    ordered = sorted(values)
+    if not ordered:
+        return dict((key, 0.0) for key in ("p50", "p90", "p99", "max"))
+    return {"p50": percentile(ordered, 50), "p90": percentile(ordered, 90),
+            "p99": percentile(ordered, 99), "max": ordered[-1]}
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,55 @@
+#############################################################################
+# The pocket pre-filter leaves the perceived interactions unchanged
+#############################################################################
+import os
+import sys
+import pytest
+
+pytest.importorskip("openeye.oechem")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark
+from activesite.batch import perceive_complex
+from activesite.extraction import extract
+from activesite.subsites import get_subsite_map
+
+
+def get_rows(iname, prefilter):
+    args = benchmark.get_default_args(prefilter=prefilter, prefilter_margin=3.0, profile=False)
+    asite, error = perceive_complex(iname, None, args)
+    assert asite is not None, error
+    return [dict(row, AtomsName_Lig=sorted(row["AtomsName_Lig"])) for row in extract(asite, get_subsite_map(args))]
+
+
+def write_complex(path, pdb):
+    with open(path, "w") as f:
+        f.write(pdb)
+    return str(path)
+
+
+def shift_ligand(pdb, dx):
+    """
+    Moves the LIG atoms of the PDB text by dx along x.
+    """
+    lines = []
+    for line in pdb.splitlines():
+        if line.startswith("HETATM") and line[17:20] == "LIG":
+            line = "%s%8.3f%s" % (line[:30], float(line[30:38]) + dx, line[38:])
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+@pytest.mark.parametrize("case", sorted(benchmark.CASES))
+def test_prefilter_keeps_rows(tmp_path, case):
+    iname = write_complex(tmp_path / ("%s.pdb" % case), benchmark.generate_complex(case))
+    rows = get_rows(iname, False)
+    assert rows
+    assert get_rows(iname, True) == rows
+
+
+def test_prefilter_far_pose(tmp_path):
+    iname = write_complex(tmp_path / "far.pdb", shift_ligand(benchmark.generate_complex("small_pocket"), 100.0))
+    rows = get_rows(iname, False)
+    assert rows == []
+    assert get_rows(iname, True) == rows